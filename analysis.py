@@ -0,0 +1,52 @@
+import numpy as np
+from scipy.stats import gaussian_kde
+
+from ingest import LRUCache
+
+
+POINT_BUDGET = 5000
+HISTOGRAM_BINS = 50
+KDE_POINTS = 200
+MAX_CACHED_SAMPLES = 4
+
+_samples = LRUCache(MAX_CACHED_SAMPLES)
+
+
+def sample_frame(df, budget=POINT_BUDGET, stratify=None, random_state=42):
+    """Return at most ``budget`` rows of ``df`` for scatter-type plots.
+
+    With ``stratify`` every value of that column keeps its share of rows;
+    otherwise the rows are a uniform random sample.
+    """
+    if len(df) <= budget:
+        return df
+    if stratify is None:
+        return df.sample(n=budget, random_state=random_state)
+    fraction = budget / len(df)
+    return (df.groupby(stratify, observed=True, dropna=False, group_keys=False)
+            .sample(frac=fraction, random_state=random_state))
+
+
+def cached_sample(key, df, budget=POINT_BUDGET, stratify=None):
+    """``sample_frame`` of ``df``, drawn once per ``key`` and reused by later reruns."""
+    sample = _samples.get(key)
+    if sample is None:
+        sample = sample_frame(df, budget, stratify=stratify)
+        _samples.put(key, sample)
+    return sample
+
+
+def histogram(series, bins=HISTOGRAM_BINS, sample=None):
+    """Pre-binned counts for a numeric column, plus a KDE curve scaled to the counts.
+
+    The counts cover every row; the KDE is fitted on ``sample`` (or the whole
+    column) since its cost grows with the number of points.
+    """
+    values = series.dropna().to_numpy(dtype=float)
+    counts, edges = np.histogram(values, bins=bins)
+    kde_x = kde_y = None
+    kde_values = values if sample is None else sample.dropna().to_numpy(dtype=float)
+    if len(kde_values) > 1 and np.ptp(kde_values) > 0:
+        kde_x = np.linspace(edges[0], edges[-1], KDE_POINTS)
+        kde_y = gaussian_kde(kde_values)(kde_x) * len(values) * (edges[1] - edges[0])
+    return counts, edges, kde_x, kde_y
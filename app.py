@@ -0,0 +1,297 @@
+"""Headless batch evaluation with the same models, metrics and plots as the Streamlit app.
+
+    python -m app evaluate --data train.csv other.parquet --model rf --target y --output results/ --export
+    python -m app serve results/train/random-forest/model.joblib --port 8000
+    python -m app bench --rows 100000 --save bench/baseline.json
+
+Every dataset gets ``<output>/<dataset>/<model>/`` with a ``metrics.json``,
+one image per evaluation plot and, with ``--export``, the fitted model and its
+preprocessing as ``model.joblib``. ``<dataset>`` is the file name without its
+extension, or its path when several inputs share that name. Several datasets are evaluated in parallel
+worker processes with ``--jobs``. ``serve`` scores exported models over HTTP.
+``bench`` times every stage on synthetic data and flags regressions against
+a saved baseline (see ``benchmark``).
+"""
+import argparse
+import ast
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+import benchmark
+from ingest import load_store
+from models import DEFAULT_PARAMS, MODEL_NAMES, build_estimator, evaluation_metrics
+from plots import evaluation_plots, render
+from preprocessing import MAX_ONEHOT_CATEGORIES, SPARSE_MODELS, dense_columns, feature_matrix, preprocess
+from serving import MAX_BATCH_ROWS, MAX_WAIT_MS, ScoringModel, load_model, serve
+from validation import cross_validate
+
+
+MODEL_ALIASES = {
+    'rf': 'Random Forest',
+    'logreg': 'Logistic Regression',
+    'svm': 'SVM',
+    'knn': 'K-Nearest Neighbors',
+    'dt': 'Decision Tree',
+    'linreg': 'Linear Regression',
+    'gb': 'Gradient Boosting',
+}
+
+
+def slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+
+def model_name(value):
+    if value in MODEL_ALIASES:
+        return MODEL_ALIASES[value]
+    for name in MODEL_NAMES:
+        if value.lower() in (name.lower(), slug(name)):
+            return name
+    raise argparse.ArgumentTypeError(f"unknown model {value!r} (choose from {', '.join(MODEL_ALIASES)})")
+
+
+def param(value):
+    # name=value, with the value parsed as a Python literal when it is one (10, 0.5, 'rbf', None)
+    name, sep, raw = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f'expected NAME=VALUE, got {value!r}')
+    try:
+        return name, ast.literal_eval(raw)
+    except (ValueError, SyntaxError):
+        return name, raw
+
+
+def output_names(paths):
+    """Output directory name per dataset path, unique across ``paths``.
+
+    The slugged file stem, unless another input has the same stem; those use
+    their path relative to the directory they share instead (``d.csv`` and
+    ``d.parquet`` become ``d-csv`` and ``d-parquet``).
+    """
+    stems = {path: slug(os.path.splitext(os.path.basename(path))[0]) for path in paths}
+    counts = Counter(stems.values())
+    clashing = [os.path.abspath(path) for path in paths if counts[stems[path]] > 1]
+    root = os.path.commonpath([os.path.dirname(path) for path in clashing]) if clashing else None
+    names = {path: slug(os.path.relpath(os.path.abspath(path), root)) if counts[stems[path]] > 1 else stems[path]
+             for path in paths}
+    duplicates = sorted(name for name, count in Counter(names.values()).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"several inputs would write to the same output directory: {', '.join(duplicates)}")
+    return names
+
+
+def read_data(path):
+    """Return ``(key, store)`` for a CSV, Parquet, Feather or Arrow file, keyed by its content hash like an upload."""
+    with open(path, 'rb') as f:
+        key, store, _ = load_store(io.BytesIO(f.read()))
+    return key, store
+
+
+def evaluate_dataset(path, model, target, features=None, params=None, output='results', preprocess_data=True,
+                     max_categories=MAX_ONEHOT_CATEGORIES, test_size=0.2, random_state=42, folds=0, fmt='png', export=False,
+                     name=None):
+    """Fit and evaluate one model on one dataset, writing its metrics and plots under ``output/name``.
+
+    ``features`` are column names of the file (default: every column but the
+    target). With ``preprocess_data`` they are expanded to their encoded
+    columns; the target is back-filled but never encoded. ``name`` defaults to
+    the file name without its extension.
+    """
+    # --param values override the app defaults one by one
+    params = {**DEFAULT_PARAMS[model], **(params or {})}
+    data_key, store = read_data(path)
+    if target not in store.columns:
+        raise ValueError(f'{path}: no target column {target!r}')
+    unknown = [column for column in features or [] if column not in store.columns]
+    if unknown:
+        raise ValueError(f"{path}: no feature column(s) {', '.join(map(repr, unknown))}")
+    columns = [column for column in (features or store.columns) if column != target]
+    # Only the used columns are read
+    df = store.read([*columns, target])
+    preprocessor = None
+    features = columns
+    if preprocess_data:
+        # Fitted on the features alone, so a text class label isn't one-hot encoded away
+        preprocessor, encoded = preprocess((data_key, tuple(columns)), df[columns], max_categories=max_categories)
+        features = [name for column in columns for name in preprocessor.encoded_columns_[column]]
+        df = pd.concat([encoded, df[target].bfill()], axis=1)
+
+    use_sparse = model in SPARSE_MODELS
+    X, feature_names = feature_matrix(df, features, use_sparse=use_sparse)
+    y = dense_columns(df, [target])[target]
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+
+    estimator = build_estimator(model, params)
+    start = time.perf_counter()
+    estimator.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+    y_pred = estimator.predict(X_test)
+
+    result = {
+        'data': path,
+        'model': model,
+        'params': params,
+        'target': target,
+        'features': list(feature_names),
+        'rows': {'train': int(X_train.shape[0]), 'test': int(X_test.shape[0])},
+        'fit_time': fit_time,
+        'metrics': {name: float(value) for name, value in evaluation_metrics(model, y_test, y_pred).items()},
+    }
+    if folds:
+        per_fold, summary = cross_validate(model, params, X, y, n_splits=folds, random_state=random_state)
+        result['cross_validation'] = {'per_fold': per_fold.to_dict(orient='index'),
+                                      'summary': summary.to_dict(orient='index')}
+
+    out_dir = os.path.join(output, name or output_names([path])[path], slug(model))
+    os.makedirs(out_dir, exist_ok=True)
+    result['plots'] = {}
+    result['plot_errors'] = {}
+    plots = evaluation_plots(model, estimator, X_train, y_train, X_test, y_test, y_pred, feature_names)
+    for title, (draw, *args) in plots.items():
+        # A plot that doesn't apply to this data (e.g. ROC on a multiclass target) shouldn't sink the run
+        try:
+            image = render(draw, *args, fmt=fmt)
+        except Exception as e:
+            result['plot_errors'][title] = str(e)
+            continue
+        filename = f'{slug(title)}.{fmt}'
+        with open(os.path.join(out_dir, filename), 'wb') as f:
+            f.write(image)
+        result['plots'][title] = filename
+
+    if export:
+        ScoringModel(model, estimator, features, target, preprocessor, use_sparse).save(os.path.join(out_dir, 'model.joblib'))
+        result['model_file'] = 'model.joblib'
+
+    with open(os.path.join(out_dir, 'metrics.json'), 'w') as f:
+        json.dump(result, f, indent=2, default=str)
+    result['output'] = out_dir
+    return result
+
+
+def evaluate(args):
+    params = dict(args.param) if args.param else None
+    options = dict(model=args.model, target=args.target, features=args.features, params=params, output=args.output,
+                   preprocess_data=args.preprocess, max_categories=args.max_categories, test_size=args.test_size,
+                   random_state=args.seed, folds=args.folds, fmt=args.format, export=args.export)
+    # The same file listed twice would only be evaluated twice into one directory
+    paths = list(dict.fromkeys(args.data))
+    try:
+        names = output_names(paths)
+    except ValueError as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 2
+    failed = 0
+    with ProcessPoolExecutor(max_workers=min(args.jobs, len(paths))) as executor:
+        futures = {path: executor.submit(evaluate_dataset, path, name=names[path], **options) for path in paths}
+        for path, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'{path}: failed: {e}', file=sys.stderr)
+                continue
+            metrics = ', '.join(f'{name} {value:.4f}' for name, value in result['metrics'].items())
+            print(f"{path}: {result['model']}: {metrics} (fit {result['fit_time']:.2f}s) -> {result['output']}")
+    return 1 if failed else 0
+
+
+def serve_model(args):
+    metrics = serve(load_model(args.model_file), host=args.host, port=args.port, max_batch_rows=args.max_batch_rows,
+                    max_wait_ms=args.max_wait_ms)
+    print(json.dumps(metrics, indent=2, default=str))
+    return 0
+
+
+def bench(args):
+    results = benchmark.run_benchmark(rows=args.rows, numeric=args.numeric, categorical=args.categorical,
+                                      cardinality=args.cardinality, models=args.models, repeats=args.repeats,
+                                      plots=args.plots, trace_memory=args.trace_memory, seed=args.seed,
+                                      progress=lambda message: print(message, file=sys.stderr))
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(benchmark.summary(results).to_string(float_format='{:.4f}'.format))
+    if args.save:
+        benchmark.save(results, args.save)
+    if not args.baseline:
+        return 0
+    try:
+        table = benchmark.compare(results, benchmark.load(args.baseline), tolerance=args.tolerance)
+    except ValueError as e:
+        print(f'{args.baseline}: {e}', file=sys.stderr)
+        return 2
+    regressions = table[table['regression']]
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(f'\nAgainst {args.baseline} (tolerance {args.tolerance:.0%}):')
+        print(table.to_string(float_format='{:.4f}'.format))
+    if len(regressions):
+        print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions.index)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m app', description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ev = commands.add_parser('evaluate', help='fit and evaluate a model on one or more datasets')
+    ev.add_argument('--data', nargs='+', required=True, help='CSV, Parquet, Feather or Arrow files')
+    ev.add_argument('--model', type=model_name, required=True, help=f"one of {', '.join(MODEL_ALIASES)} or a full model name")
+    ev.add_argument('--target', required=True)
+    ev.add_argument('--features', nargs='+', help='feature columns (default: every other column)')
+    ev.add_argument('--param', type=param, action='append', metavar='NAME=VALUE',
+                    help='model hyperparameter, repeatable (default: the app defaults)')
+    ev.add_argument('--output', default='results', help='output directory (default: %(default)s)')
+    ev.add_argument('--preprocess', action=argparse.BooleanOptionalAction, default=True,
+                    help='back-fill nulls and encode categorical columns (default: on)')
+    ev.add_argument('--max-categories', type=int, default=MAX_ONEHOT_CATEGORIES)
+    ev.add_argument('--test-size', type=float, default=0.2)
+    ev.add_argument('--seed', type=int, default=42)
+    ev.add_argument('--folds', type=int, default=0, help='also run k-fold cross-validation with this many folds')
+    ev.add_argument('--format', default='png', choices=['png', 'svg', 'pdf'])
+    ev.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='datasets evaluated in parallel')
+    ev.add_argument('--export', action='store_true', help='also save the fitted model and its preprocessing')
+    ev.set_defaults(func=evaluate)
+
+    sv = commands.add_parser('serve', help='score an exported model over HTTP with micro-batching')
+    sv.add_argument('model_file', help='a model.joblib written by --export or the app')
+    sv.add_argument('--host', default='127.0.0.1')
+    sv.add_argument('--port', type=int, default=8000)
+    sv.add_argument('--max-batch-rows', type=int, default=MAX_BATCH_ROWS)
+    sv.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS,
+                    help='how long a batch waits for more requests (default: %(default)s)')
+    sv.set_defaults(func=serve_model)
+
+    bn = commands.add_parser('bench', help='time every stage on synthetic data and compare with a baseline')
+    bn.add_argument('--rows', type=int, default=100000)
+    bn.add_argument('--numeric', type=int, default=10, help='numeric feature columns')
+    bn.add_argument('--categorical', type=int, default=2, help='categorical feature columns')
+    bn.add_argument('--cardinality', type=int, default=20, help='distinct values per categorical column')
+    bn.add_argument('--models', type=model_name, nargs='+', help='models to time (default: all of them)')
+    bn.add_argument('--repeats', type=int, default=3)
+    bn.add_argument('--plots', action=argparse.BooleanOptionalAction, default=True, help='also render every plot')
+    bn.add_argument('--trace-memory', action='store_true', help='record tracemalloc peaks (slower)')
+    bn.add_argument('--seed', type=int, default=0)
+    bn.add_argument('--save', help='write the results to this JSON file')
+    bn.add_argument('--baseline', help='results JSON to compare against; exits 1 on a regression')
+    bn.add_argument('--tolerance', type=float, default=0.2,
+                    help='allowed slowdown of a stage median, as a fraction (default: %(default)s)')
+    bn.set_defaults(func=bench)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
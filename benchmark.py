@@ -0,0 +1,189 @@
+"""Headless benchmark of the app's code paths on synthetic data.
+
+    python -m app bench --rows 200000 --numeric 10 --categorical 4 --cardinality 50 --save bench/v2.json
+    python -m app bench --rows 200000 --numeric 10 --categorical 4 --cardinality 50 --baseline bench/v2.json
+
+Every stage main() runs (CSV parse, bfill, encode, feature matrix, split)
+and the fit, predict and plots of each model are timed over several
+repeats, bypassing every cache. Results are saved as JSON with the dataset
+configuration and library versions, and compared stage by stage against a
+baseline saved the same way.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.model_selection import train_test_split
+
+from ingest import parse_csv
+from instrumentation import Recorder, stage
+from models import DEFAULT_PARAMS, MODEL_NAMES, REGRESSION_MODELS, build_estimator
+from plots import evaluation_plots, render
+from preprocessing import SPARSE_MODELS, Preprocessor, dense_columns, feature_matrix
+
+
+CLASS_TARGET = 'label'
+REGRESSION_TARGET = 'value'
+NULL_RATE = 0.01
+# Stages faster than this are too noisy to call regressions on
+MIN_REGRESSION_SECONDS = 0.01
+
+
+def synthetic_csv(rows, numeric=10, categorical=2, cardinality=20, null_rate=NULL_RATE, seed=0):
+    """CSV bytes with normal numeric columns, categorical columns and both kinds of target.
+
+    ``label`` is a binary class and ``value`` a continuous target, each a
+    noisy function of the features so every model has something to learn.
+    A ``null_rate`` share of the feature values is missing.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({f'x{i}': rng.normal(size=rows) for i in range(numeric)})
+    signal = df.to_numpy().sum(axis=1) if numeric else np.zeros(rows)
+    for i in range(categorical):
+        codes = rng.integers(cardinality, size=rows)
+        df[f'c{i}'] = np.char.add(f'c{i}_', codes.astype(str))
+        signal += rng.normal(size=cardinality)[codes]
+    for column in df.columns:
+        df.loc[rng.random(rows) < null_rate, column] = np.nan
+    df[CLASS_TARGET] = (signal + rng.normal(size=rows) > 0).astype(int)
+    df[REGRESSION_TARGET] = signal + rng.normal(size=rows)
+    return df.to_csv(index=False).encode()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _run_model(df, features, model, plots, fmt):
+    target = REGRESSION_TARGET if model in REGRESSION_MODELS else CLASS_TARGET
+    with stage('feature matrix'):
+        X, feature_names = feature_matrix(df, features, use_sparse=model in SPARSE_MODELS)
+        y = dense_columns(df, [target])[target]
+    with stage('split'):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    estimator = build_estimator(model, DEFAULT_PARAMS[model])
+    with stage('fit'):
+        estimator.fit(X_train, y_train)
+    with stage('predict'):
+        y_pred = estimator.predict(X_test)
+    if plots:
+        with stage('plots'):
+            for title, (draw, *args) in evaluation_plots(model, estimator, X_train, y_train, X_test, y_test,
+                                                         y_pred, feature_names).items():
+                try:
+                    render(draw, *args, fmt=fmt)
+                except Exception:
+                    # Same as the CLI: a plot that doesn't apply is skipped, not fatal
+                    pass
+
+
+def _run_once(data, models, plots, fmt, trace_memory):
+    # Returns the records of one repeat; model stages are named '<model>: <stage>'
+    recorder = Recorder(trace_memory=trace_memory)
+    with recorder.active():
+        with stage('parse CSV'):
+            df = parse_csv(data)
+        # Preprocessor.fit_transform records bfill and encode itself
+        df = Preprocessor().fit_transform(df)
+    records = list(recorder.records)
+    features = [column for column in df.columns if column not in (CLASS_TARGET, REGRESSION_TARGET)]
+    for model in models:
+        # A recorder per model, so nested stages (e.g. class scores) are attributed to it
+        recorder = Recorder(trace_memory=trace_memory)
+        with recorder.active():
+            _run_model(df, features, model, plots, fmt)
+        records += [dict(record, stage=f"{model}: {record['stage']}") for record in recorder.records]
+    return records
+
+
+def run_benchmark(rows=100000, numeric=10, categorical=2, cardinality=20, models=None, repeats=3, plots=True,
+                  fmt='png', trace_memory=False, seed=0, progress=None):
+    """Time every stage ``repeats`` times and return the results as a JSON-able dict.
+
+    Each stage gets its wall and CPU times per repeat and their median and
+    minimum; with ``trace_memory`` also its largest tracemalloc peak.
+    """
+    models = list(models or MODEL_NAMES)
+    config = {'rows': rows, 'numeric': numeric, 'categorical': categorical, 'cardinality': cardinality,
+              'models': models, 'repeats': repeats, 'plots': plots, 'fmt': fmt, 'seed': seed}
+    data = synthetic_csv(rows, numeric, categorical, cardinality, seed=seed)
+    timings = {}
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        records = _run_once(data, models, plots, fmt, trace_memory)
+        if progress:
+            progress(f'repeat {repeat + 1}/{repeats}: {time.perf_counter() - start:.2f}s')
+        for record in records:
+            entry = timings.setdefault(record['stage'], {'wall_s': [], 'cpu_s': [], 'peak_alloc_mb': []})
+            entry['wall_s'].append(record['wall_s'])
+            entry['cpu_s'].append(record['cpu_s'])
+            if record['peak_alloc_mb'] is not None:
+                entry['peak_alloc_mb'].append(record['peak_alloc_mb'])
+    stages = {}
+    for name, entry in timings.items():
+        stages[name] = {
+            'median_s': statistics.median(entry['wall_s']),
+            'min_s': min(entry['wall_s']),
+            'cpu_median_s': statistics.median(entry['cpu_s']),
+            'wall_s': entry['wall_s'],
+            'peak_alloc_mb': max(entry['peak_alloc_mb']) if entry['peak_alloc_mb'] else None,
+        }
+    return {'config': config, 'environment': environment(), 'csv_bytes': len(data), 'stages': stages}
+
+
+def compare(results, baseline, tolerance=0.2, min_seconds=MIN_REGRESSION_SECONDS):
+    """Stage-by-stage comparison of two benchmark results, as a frame.
+
+    A stage regressed when its median is more than ``tolerance`` (a
+    fraction) slower than the baseline's and by at least ``min_seconds``.
+    Stages only present in one of the two results are listed with NaN.
+    """
+    # The number of repeats changes the confidence, not what is measured
+    changed = sorted(key for key in results['config'].keys() | baseline['config'].keys()
+                     if key != 'repeats' and results['config'].get(key) != baseline['config'].get(key))
+    if changed:
+        raise ValueError(f"The baseline was run with a different configuration ({', '.join(changed)})")
+    names = list(results['stages']) + [name for name in baseline['stages'] if name not in results['stages']]
+    current = pd.Series({name: results['stages'].get(name, {}).get('median_s', np.nan) for name in names})
+    before = pd.Series({name: baseline['stages'].get(name, {}).get('median_s', np.nan) for name in names})
+    table = pd.DataFrame({'baseline_s': before, 'current_s': current, 'change': current / before - 1})
+    table['regression'] = (table['change'] > tolerance) & (table['current_s'] - table['baseline_s'] >= min_seconds)
+    return table
+
+
+def summary(results):
+    return pd.DataFrame({name: {key: stats[key] for key in ('median_s', 'min_s', 'cpu_median_s', 'peak_alloc_mb')}
+                         for name, stats in results['stages'].items()}).T
+
+
+def save(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,154 @@
+import threading
+
+import numpy as np
+from sklearn.metrics import auc
+
+from ingest import LRUCache
+from instrumentation import stage
+
+
+# Above this many test rows the curves are built from score histograms instead of a full sort
+APPROXIMATE_ROWS = 1000000
+CURVE_BINS = 2048
+CALIBRATION_BINS = 10
+MAX_CACHED_CURVES = 8
+
+_curves = LRUCache(MAX_CACHED_CURVES)
+
+
+def class_scores(estimator, X):
+    """Continuous scores per class: ``(scores, is_probability)``.
+
+    ``scores`` has one column per class in ``estimator.classes_`` order. Taken
+    from ``predict_proba`` when the estimator has it, else ``decision_function``
+    (a binary decision function becomes ``[-d, d]``).
+    """
+    if hasattr(estimator, 'predict_proba'):
+        return np.asarray(estimator.predict_proba(X), dtype=float), True
+    scores = np.asarray(estimator.decision_function(X), dtype=float)
+    if scores.ndim == 1:
+        scores = np.column_stack([-scores, scores])
+    return scores, False
+
+
+def _counts_sorted(positive, score):
+    # One descending sort; a curve point at the last row of every distinct score
+    order = np.argsort(-score, kind='mergesort')
+    score = score[order]
+    tps = np.cumsum(positive[order])
+    last = np.r_[np.flatnonzero(np.diff(score)), len(score) - 1]
+    return score[last], tps[last], last + 1 - tps[last]
+
+
+def _counts_binned(positive, score, bins):
+    # Positives and negatives per score bin, accumulated from the top bin down
+    lo, hi = score.min(), score.max()
+    if hi == lo:
+        return np.array([lo]), np.array([positive.sum()]), np.array([len(score) - positive.sum()])
+    edges = np.linspace(lo, hi, bins + 1)
+    index = np.minimum(((score - lo) / (hi - lo) * bins).astype(np.int64), bins - 1)
+    pos = np.bincount(index, weights=positive, minlength=bins)[::-1]
+    total = np.bincount(index, minlength=bins)[::-1]
+    tps = np.cumsum(pos)
+    return edges[:-1][::-1], tps, np.cumsum(total) - tps
+
+
+def binary_curve(positive, score, bins=None):
+    """ROC, precision-recall and threshold-sweep arrays for one positive class.
+
+    Every threshold's true/false positive counts come from one sorted
+    cumulative sum over the scores, or with ``bins`` from a histogram of
+    them (the thresholds are then the bin edges).
+    """
+    positive = np.asarray(positive, dtype=float)
+    score = np.asarray(score, dtype=float)
+    thresholds, tps, fps = _counts_binned(positive, score, bins) if bins else _counts_sorted(positive, score)
+    n_pos, n_neg = tps[-1], fps[-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tpr = np.r_[0.0, tps / n_pos]
+        fpr = np.r_[0.0, fps / n_neg]
+        precision = np.r_[1.0, tps / (tps + fps)]
+        f1 = 2 * tps / (2 * tps + fps + (n_pos - tps))
+    return {
+        'thresholds': thresholds,
+        'fpr': fpr,
+        'tpr': tpr,
+        'precision': precision,
+        'recall': tpr,
+        'f1': f1,
+        'roc_auc': float(auc(fpr, tpr)) if n_pos and n_neg else np.nan,
+        'average_precision': float(np.sum(np.diff(tpr) * precision[1:])) if n_pos else np.nan,
+    }
+
+
+def calibration(positive, probability, bins=CALIBRATION_BINS):
+    """Mean predicted probability vs observed positive rate in equal-width probability bins."""
+    index = np.minimum((np.asarray(probability) * bins).astype(np.int64), bins - 1)
+    count = np.bincount(index, minlength=bins)
+    filled = count > 0
+    predicted = np.bincount(index, weights=probability, minlength=bins)[filled] / count[filled]
+    observed = np.bincount(index, weights=positive, minlength=bins)[filled] / count[filled]
+    return predicted, observed, count[filled]
+
+
+class ScoreCurves:
+    """Class scores and every score-based curve for one fitted model on a test set.
+
+    Nothing is computed until first used; the scores are computed once and
+    shared by all the curves, so it is safe to hand one instance to several
+    plots drawn concurrently. Binary targets get a single curve for the
+    positive class (``classes[1]``), multiclass targets one-vs-rest curves.
+    Test sets above ``approximate_rows`` rows use binned curves.
+    """
+
+    def __init__(self, estimator, X_test, y_test, approximate_rows=APPROXIMATE_ROWS, bins=CURVE_BINS):
+        self.estimator = estimator
+        self.X_test = X_test
+        self.y_test = np.asarray(y_test)
+        self.binned = len(self.y_test) > approximate_rows
+        self.bins = bins
+        self._lock = threading.Lock()
+        self._result = None
+
+    def _compute(self):
+        with self._lock:
+            if self._result is None:
+                with stage('class scores'):
+                    scores, is_probability = class_scores(self.estimator, self.X_test)
+                classes = self.estimator.classes_
+                labels = [classes[1]] if len(classes) == 2 else list(classes)
+                columns = [1] if len(classes) == 2 else range(len(classes))
+                bins = self.bins if self.binned else None
+                curves = {}
+                for label, column in zip(labels, columns):
+                    positive = self.y_test == label
+                    curves[label] = binary_curve(positive, scores[:, column], bins=bins)
+                    if is_probability:
+                        curves[label]['calibration'] = calibration(positive, scores[:, column])
+                self._result = (scores, is_probability, classes, curves)
+        return self._result
+
+    @property
+    def scores(self):
+        return self._compute()[0]
+
+    @property
+    def is_probability(self):
+        return self._compute()[1]
+
+    @property
+    def classes(self):
+        return self._compute()[2]
+
+    @property
+    def curves(self):
+        return self._compute()[3]
+
+
+def score_curves(key, estimator, X_test, y_test):
+    """The ``ScoreCurves`` for a fitted configuration, shared across reruns."""
+    curves = _curves.get(key)
+    if curves is None:
+        curves = ScoreCurves(estimator, X_test, y_test)
+        _curves.put(key, curves)
+    return curves
@@ -0,0 +1,316 @@
+import os
+import pickle
+import re
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin, RegressorMixin, clone
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+from sklearn.utils.metaestimators import available_if
+
+from ingest import CACHE_DIR, LRUCache, prune_disk_cache, touch
+from models import build_estimator, evaluation_metrics
+
+
+INITIAL_EPOCHS = 5
+CHUNK_EPOCHS = 1
+MAX_CACHED_SESSIONS = 4
+SESSION_DIR = os.path.join(CACHE_DIR, 'sessions')
+SESSION_DISK_BYTES = int(os.environ.get('EVAL_SESSION_DISK_BYTES', 2 * 2**30))
+BASE_FILE = 'base.joblib'
+CHUNK_FILE = 'chunk-{:06d}.joblib'
+CHUNK_PATTERN = re.compile(r'chunk-\d{6}\.joblib')
+
+# Models that can take new rows without refitting on the history
+INCREMENTAL_MODELS = {'Linear Regression', 'Logistic Regression', 'SVM', 'Random Forest'}
+
+_sessions = LRUCache(MAX_CACHED_SESSIONS)
+
+
+def _dense(X):
+    if sparse.issparse(X):
+        return X.toarray()
+    return X.to_numpy(dtype=float) if isinstance(X, pd.DataFrame) else np.asarray(X, dtype=float)
+
+
+class StreamingLinearRegression(RegressorMixin, BaseEstimator):
+    """Ordinary least squares from running sufficient statistics.
+
+    ``partial_fit`` only adds the chunk's ``X'X``, ``X'y`` and sums, so the
+    fitted coefficients always equal ``LinearRegression`` on every row seen,
+    for a cost that depends on the chunk and the number of features only.
+    """
+
+    def partial_fit(self, X, y):
+        X = X.tocsr() if sparse.issparse(X) else _dense(X)
+        y = np.asarray(y, dtype=float)
+        if not hasattr(self, 'n_seen_'):
+            n_features = X.shape[1]
+            self.n_seen_ = 0
+            self.sum_x_ = np.zeros(n_features)
+            self.sum_y_ = 0.0
+            self.xtx_ = np.zeros((n_features, n_features))
+            self.xty_ = np.zeros(n_features)
+        self.n_seen_ += X.shape[0]
+        self.sum_x_ += np.asarray(X.sum(axis=0)).ravel()
+        self.sum_y_ += y.sum()
+        self.xtx_ += _dense(X.T @ X)
+        self.xty_ += np.asarray(X.T @ y).ravel()
+        self._solve()
+        return self
+
+    def fit(self, X, y):
+        for name in ('n_seen_', 'sum_x_', 'sum_y_', 'xtx_', 'xty_'):
+            self.__dict__.pop(name, None)
+        return self.partial_fit(X, y)
+
+    def _solve(self):
+        # Centred normal equations, as LinearRegression centres before solving
+        mean_x = self.sum_x_ / self.n_seen_
+        mean_y = self.sum_y_ / self.n_seen_
+        sxx = self.xtx_ - self.n_seen_ * np.outer(mean_x, mean_x)
+        sxy = self.xty_ - self.n_seen_ * mean_x * mean_y
+        self.coef_ = np.linalg.lstsq(sxx, sxy, rcond=None)[0]
+        self.intercept_ = mean_y - mean_x @ self.coef_
+        self.n_features_in_ = len(self.coef_)
+
+    def predict(self, X):
+        return np.asarray(X @ self.coef_).ravel() + self.intercept_
+
+
+class OnlineLinearClassifier(ClassifierMixin, BaseEstimator):
+    """SGD linear classifier with a streaming feature scaler, updated chunk by chunk.
+
+    ``loss='log_loss'`` stands in for logistic regression and ``'hinge'`` for
+    the linear SVM. ``C`` maps to SGD's ``alpha = 1 / (C * n)`` using the rows
+    of the first fit. Features are scaled by their running standard deviation
+    (no centring, so sparse input stays sparse).
+    """
+
+    def __init__(self, loss='log_loss', C=1.0, random_state=42):
+        self.loss = loss
+        self.C = C
+        self.random_state = random_state
+
+    def partial_fit(self, X, y, classes=None, epochs=CHUNK_EPOCHS):
+        y = np.asarray(y)
+        if not hasattr(self, 'sgd_'):
+            self.classes_ = np.unique(y) if classes is None else np.asarray(classes)
+            self.scaler_ = StandardScaler(with_mean=False)
+            # Averaged SGD converges close to the batch solution in a few passes
+            self.sgd_ = SGDClassifier(loss=self.loss, alpha=1.0 / (self.C * len(y)), average=True,
+                                      random_state=self.random_state)
+        unknown = np.setdiff1d(np.unique(y), self.classes_)
+        if len(unknown):
+            raise ValueError(f'New rows have classes the model was not first fitted with: {list(unknown)}')
+        X = self.scaler_.partial_fit(X).transform(X)
+        rng = np.random.default_rng(self.random_state)
+        for _ in range(epochs):
+            order = rng.permutation(X.shape[0])
+            self.sgd_.partial_fit(X[order], y[order], classes=self.classes_)
+        self.n_features_in_ = X.shape[1]
+        return self
+
+    def fit(self, X, y):
+        for name in ('sgd_', 'scaler_', 'classes_'):
+            self.__dict__.pop(name, None)
+        return self.partial_fit(X, y, epochs=INITIAL_EPOCHS)
+
+    def decision_function(self, X):
+        return self.sgd_.decision_function(self.scaler_.transform(X))
+
+    def predict(self, X):
+        return self.sgd_.predict(self.scaler_.transform(X))
+
+    @available_if(lambda self: self.loss == 'log_loss')
+    def predict_proba(self, X):
+        return self.sgd_.predict_proba(self.scaler_.transform(X))
+
+    @property
+    def coef_(self):
+        # In the original feature units
+        return self.sgd_.coef_ / np.where(self.scaler_.scale_ > 0, self.scaler_.scale_, 1)
+
+
+def _repeat_first_row(X, n):
+    if sparse.issparse(X):
+        return X[[0] * n]
+    return X.iloc[[0] * n] if isinstance(X, pd.DataFrame) else np.asarray(X)[[0] * n]
+
+
+def _stack(X, extra):
+    if sparse.issparse(X):
+        return sparse.vstack([X, extra], format='csr')
+    return pd.concat([X, extra]) if isinstance(X, pd.DataFrame) else np.vstack([X, extra])
+
+
+def grow_forest(forest, X, y, n_new):
+    """Add ``n_new`` trees trained only on ``(X, y)`` to a fitted random forest."""
+    y = np.asarray(y)
+    unknown = np.setdiff1d(np.unique(y), forest.classes_)
+    if len(unknown):
+        raise ValueError(f'New rows have classes the model was not first fitted with: {list(unknown)}')
+    weight = np.ones(len(y))
+    missing = np.setdiff1d(forest.classes_, y)
+    if len(missing):
+        # Zero-weight rows for classes the chunk lacks, so every new tree has the forest's class columns
+        X = _stack(X, _repeat_first_row(X, len(missing)))
+        y = np.concatenate([y, missing])
+        weight = np.concatenate([weight, np.zeros(len(missing))])
+    random_state = (forest.random_state or 0) + len(forest.estimators_)
+    extra = clone(forest).set_params(n_estimators=n_new, random_state=random_state).fit(X, y, sample_weight=weight)
+    forest.estimators_ += extra.estimators_
+    forest.n_estimators = len(forest.estimators_)
+    return forest
+
+
+def build_incremental(model_name, params):
+    if model_name == 'Linear Regression':
+        return StreamingLinearRegression()
+    elif model_name == 'Logistic Regression':
+        return OnlineLinearClassifier(loss='log_loss', C=params.get('C', 1.0))
+    elif model_name == 'SVM':
+        if params.get('kernel', 'linear') != 'linear':
+            raise ValueError('Only the linear SVM kernel can be trained incrementally')
+        return OnlineLinearClassifier(loss='hinge', C=params.get('C', 1.0))
+    elif model_name == 'Random Forest':
+        # New trees are fitted on raw features, so the histogram forest's fixed bins don't apply
+        return build_estimator(model_name, {name: value for name, value in params.items() if name != 'max_bins'})
+    raise ValueError(f'{model_name} cannot be trained incrementally')
+
+
+class IncrementalSession:
+    """A model trained on a base dataset and then updated with appended chunks.
+
+    Every chunk is scored by the current model before it is trained on
+    (test-then-train), so each update costs time in proportion to the chunk
+    rather than the history, and the scores are on rows the model has not
+    seen. Chunks are identified by key and only applied once.
+
+    With a ``directory`` the session survives eviction and restarts (see
+    ``get_session``): the base fit is written there once, and every chunk
+    adds a file with only what it changed (the new trees of a forest, or the
+    fixed-size linear model), so saving also scales with the chunk. Session
+    directories beyond ``SESSION_DISK_BYTES`` are removed least recently
+    used first.
+    """
+
+    def __init__(self, model_name, params, directory=None):
+        self.model_name = model_name
+        self.params = dict(params)
+        self.estimator = build_incremental(model_name, params)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.fitted = False
+        self.chunk_keys = []
+        self.rows = 0
+        self.base_rows = 0
+        self.records = []
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock'], state['directory']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.directory = None
+
+    def _dump(self, value, name):
+        # Called with the lock held
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        joblib.dump(value, tmp_path)
+        os.replace(tmp_path, path)
+        # Least recently updated sessions go first; the ones in memory are still being appended to
+        in_use = [session.directory for session in _sessions.values() if session.directory is not None]
+        prune_disk_cache(os.path.dirname(self.directory), SESSION_DISK_BYTES, keep=in_use + [self.directory])
+
+    def fit(self, X, y):
+        with self.lock:
+            if self.fitted:
+                return
+            start = time.perf_counter()
+            self.estimator.fit(X, y)
+            self.base_rows = self.rows = X.shape[0]
+            self.fitted = True
+            # Chunk 0 is the base dataset
+            self.records.append({'Chunk': 0, 'Rows': self.rows, 'Total Rows': self.rows,
+                                 'Update Time (s)': time.perf_counter() - start})
+            if self.directory is not None and os.path.isdir(self.directory):
+                # Chunks left over from a session whose base file was lost don't belong to this one
+                for name in os.listdir(self.directory):
+                    if CHUNK_PATTERN.fullmatch(name):
+                        os.remove(os.path.join(self.directory, name))
+            self._dump(self, BASE_FILE)
+
+    def update(self, chunk_key, X, y):
+        """Score and then train on a new chunk. Returns its history row, or None if already applied."""
+        with self.lock:
+            if chunk_key in self.chunk_keys:
+                return None
+            metrics = evaluation_metrics(self.model_name, y, self.estimator.predict(X))
+            start = time.perf_counter()
+            if self.model_name == 'Random Forest':
+                # New trees in proportion to the chunk's share of the base data
+                n_new = max(1, round(self.params.get('n_estimators', 100) * X.shape[0] / self.base_rows))
+                grow_forest(self.estimator, X, y, n_new)
+                delta = self.estimator.estimators_[-n_new:]
+            else:
+                self.estimator.partial_fit(X, y)
+                delta = self.estimator
+            record = {'Chunk': len(self.chunk_keys) + 1, 'Rows': X.shape[0], 'Total Rows': self.rows + X.shape[0],
+                      'Update Time (s)': time.perf_counter() - start, **metrics}
+            self._apply(chunk_key, record)
+            self._dump((chunk_key, record, delta), CHUNK_FILE.format(record['Chunk']))
+            return record
+
+    def _apply(self, chunk_key, record, delta=None):
+        # Bookkeeping for an applied chunk; ``delta`` is given when replaying a saved one
+        if delta is not None and self.model_name == 'Random Forest':
+            self.estimator.estimators_ += delta
+            self.estimator.n_estimators = len(self.estimator.estimators_)
+        elif delta is not None:
+            self.estimator = delta
+        self.rows = record['Total Rows']
+        self.chunk_keys.append(chunk_key)
+        self.records.append(record)
+
+    def history(self):
+        return pd.DataFrame(self.records).set_index('Chunk')
+
+
+def _load_session(directory):
+    """The saved base session with its chunks replayed in order, or None."""
+    try:
+        session = joblib.load(os.path.join(directory, BASE_FILE))
+        if not isinstance(session, IncrementalSession):
+            return None
+        for name in sorted(name for name in os.listdir(directory) if CHUNK_PATTERN.fullmatch(name)):
+            session._apply(*joblib.load(os.path.join(directory, name)))
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    session.directory = directory
+    touch(directory)
+    return session
+
+
+def get_session(key, model_name, params, persist=False, session_dir=SESSION_DIR):
+    """The session for ``key``: from memory, else (with ``persist``) from ``session_dir``, else a new one."""
+    session = _sessions.get(key)
+    if session is None:
+        directory = os.path.join(session_dir, key) if persist else None
+        session = _load_session(directory) if persist else None
+        if session is None:
+            session = IncrementalSession(model_name, params, directory=directory)
+        _sessions.put(key, session)
+    return session
@@ -0,0 +1,542 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from instrumentation import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pyarrow import feather
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+CACHE_DIR = os.environ.get('EVAL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'supervised-eval'))
+DATA_DISK_BYTES = int(os.environ.get('EVAL_DATA_DISK_BYTES', 8 * 2**30))
+MAX_CACHED_FRAMES = 4
+MAX_CACHED_UPLOAD_HASHES = 64
+DTYPE_SAMPLE_ROWS = 10000
+CHUNK_ROWS = 200000
+CATEGORY_RATIO = 0.5
+# Parquet schema metadata key for the load stats of a cached file
+STATS_METADATA_KEY = b'supervised-eval:load-stats'
+
+
+class LRUCache:
+    """Bounded in-process cache that evicts the least recently used entry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def values(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_stores = LRUCache(MAX_CACHED_FRAMES)
+
+
+def _disk_bytes(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def touch(path):
+    """Mark a disk cache entry as just used, so ``prune_disk_cache`` evicts it last."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def prune_disk_cache(directory, max_bytes, suffix='', keep=()):
+    """Delete the least recently used entries of ``directory`` until they fit in ``max_bytes``.
+
+    Entries are the files or directories directly in ``directory`` whose name
+    ends with ``suffix``, ordered by modification time (see ``touch``). The
+    newest entry and the paths in ``keep`` (still in use in memory) are
+    never deleted.
+    """
+    entries = []
+    try:
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(suffix) and not entry.name.endswith('.tmp'):
+                    entries.append((entry.stat().st_mtime, _disk_bytes(entry.path), entry.path))
+    except OSError:
+        return
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    keep = {os.path.abspath(path) for path in keep}
+    for _, size, path in entries[:-1]:
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        # Another process may be using or removing it too
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+_upload_hashes = LRUCache(MAX_CACHED_UPLOAD_HASHES)
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def upload_hash(uploaded_file):
+    """Return ``(hash, format)`` of an upload, hashed once per upload rather than on every rerun.
+
+    Streamlit uploads are identified by ``file_id``; other file objects (e.g.
+    the CLI's ``BytesIO``) are hashed every time.
+    """
+    file_id = getattr(uploaded_file, 'file_id', None)
+    entry = _upload_hashes.get(file_id) if file_id is not None else None
+    if entry is None:
+        data = uploaded_file.getvalue()
+        with stage('hash upload'):
+            entry = (hash_bytes(data), file_format(data))
+        if file_id is not None:
+            _upload_hashes.put(file_id, entry)
+    return entry
+
+
+def infer_dtypes(data, sample_rows=DTYPE_SAMPLE_ROWS):
+    # Infer column dtypes from the head of the file so the full parse doesn't
+    # have to guess (and re-guess) per chunk
+    sample = pd.read_csv(io.BytesIO(data), nrows=sample_rows)
+    dtypes = {}
+    for column, dtype in sample.dtypes.items():
+        # Integer and boolean columns are left to pandas, they may still turn
+        # out to contain nulls further down the file
+        if pd.api.types.is_float_dtype(dtype):
+            dtypes[column] = 'float64'
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            dtypes[column] = dtype
+    return dtypes
+
+
+def parse_csv(data):
+    try:
+        return pd.read_csv(io.BytesIO(data), dtype=infer_dtypes(data))
+    except (ValueError, TypeError):
+        # The sample was not representative (e.g. a numeric column turns into
+        # text later on), let pandas infer everything from the full file
+        return pd.read_csv(io.BytesIO(data), low_memory=False)
+
+
+def downcast_numeric(series):
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return pd.to_numeric(series, downcast='unsigned' if series.min() >= 0 else 'integer')
+    if pd.api.types.is_float_dtype(series.dtype):
+        values = series.to_numpy()
+        narrowed = values.astype(np.float32)
+        # Only narrow floats when every value survives the round trip
+        if np.array_equal(narrowed.astype(values.dtype), values, equal_nan=True):
+            return pd.Series(narrowed, index=series.index, name=series.name)
+    return series
+
+
+def compact_frame(df, category_columns=None, category_ratio=CATEGORY_RATIO):
+    """Downcast numeric columns and turn low-cardinality text columns into ``category``.
+
+    ``category_columns`` pins the set of columns to convert so that every chunk of
+    a streamed file ends up with the same schema; when omitted it is derived from
+    ``df`` and returned alongside the compacted frame.
+    """
+    if category_columns is None:
+        category_columns = [
+            column for column in df.columns
+            if (pd.api.types.is_object_dtype(df[column].dtype) or pd.api.types.is_string_dtype(df[column].dtype))
+            and df[column].nunique(dropna=True) <= max(1, category_ratio * len(df))
+        ]
+    columns = {}
+    for column in df.columns:
+        if column in category_columns:
+            columns[column] = df[column].astype('category')
+        elif pd.api.types.is_numeric_dtype(df[column].dtype):
+            columns[column] = downcast_numeric(df[column])
+        else:
+            columns[column] = df[column]
+    return pd.DataFrame(columns, index=df.index), category_columns
+
+
+def concat_frames(frames):
+    # pd.concat falls back to object for categoricals whose categories differ,
+    # so align them on the union first
+    frames = [frame for frame in frames if frame is not None]
+    if len(frames) == 1:
+        return frames[0]
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in frames[0].columns:
+        if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = union_categoricals([frame[column] for frame in frames], ignore_order=True).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def frame_memory(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def parse_csv_chunked(data, chunksize=CHUNK_ROWS, max_rows=None, random_state=42):
+    """Stream a CSV in chunks into a compact frame.
+
+    When the file has more than ``max_rows`` rows a uniform reservoir sample of
+    ``max_rows`` rows is kept instead (bottom-k on a random key per row, which
+    only ever holds ``max_rows + chunksize`` rows in memory). Returns the frame
+    and a dict with row counts and memory figures.
+    """
+    try:
+        return _parse_chunks(data, infer_dtypes(data), chunksize, max_rows, random_state)
+    except (ValueError, TypeError):
+        # As in parse_csv: the sample was not representative, so start over and
+        # let pandas infer each chunk; columns that turned out to hold text are text throughout
+        df, stats = _parse_chunks(data, None, chunksize, max_rows, random_state)
+        return _text_mixed_columns(df), stats
+
+
+def _text_mixed_columns(df):
+    # A column parsed as numbers in some chunks and text in others holds both after concat
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_object_dtype(series.dtype):
+            series = series.where(series.isna(), series.astype(str))
+        columns[column] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _parse_chunks(data, dtypes, chunksize, max_rows, random_state):
+    rng = np.random.default_rng(random_state)
+    category_columns = None
+    kept = []
+    reservoir = None
+    rows_read = 0
+    peak_bytes = 0
+
+    for chunk in pd.read_csv(io.BytesIO(data), dtype=dtypes, chunksize=chunksize):
+        rows_read += len(chunk)
+        chunk, category_columns = compact_frame(chunk, category_columns)
+        if max_rows is None:
+            kept.append(chunk)
+            held = sum(frame_memory(frame) for frame in kept)
+        else:
+            chunk = chunk.assign(_reservoir_key=rng.random(len(chunk)),
+                                 _reservoir_row=np.arange(rows_read - len(chunk), rows_read))
+            reservoir = concat_frames([reservoir, chunk])
+            held = frame_memory(reservoir)
+            if len(reservoir) > max_rows:
+                reservoir = reservoir.nsmallest(max_rows, '_reservoir_key').reset_index(drop=True)
+        peak_bytes = max(peak_bytes, held)
+
+    if max_rows is None:
+        df = concat_frames(kept) if kept else pd.read_csv(io.BytesIO(data), nrows=0)
+    elif reservoir is None:
+        df = pd.read_csv(io.BytesIO(data), nrows=0)
+    else:
+        # Restore file order so the preview still shows rows as they appear in the file
+        df = (reservoir.sort_values('_reservoir_row')
+              .drop(columns=['_reservoir_key', '_reservoir_row'])
+              .reset_index(drop=True))
+    # Columns that only got nulls in some chunks end up float64 again after concat
+    df, _ = compact_frame(df, category_columns=[c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)])
+
+    stats = {
+        'rows_read': rows_read,
+        'rows_kept': len(df),
+        'sampled': max_rows is not None and rows_read > max_rows,
+        'memory_bytes': frame_memory(df),
+        'peak_bytes': max(peak_bytes, frame_memory(df)),
+    }
+    return df, stats
+
+
+class ColumnStore:
+    """A dataset held column by column, converted to pandas only for the columns asked for.
+
+    Backed by an Arrow table, or by Parquet data (a file path or an in-memory
+    buffer) whose columns are only decoded on first use. Without pyarrow (or for object columns Arrow can't type) it
+    wraps a plain pandas frame instead. ``read`` converts each column once and
+    reuses it; numeric columns without nulls come out as NumPy views of the
+    Arrow buffers rather than copies.
+    """
+
+    def __init__(self, table=None, parquet=None, frame=None):
+        self._lock = threading.Lock()
+        self._parquet = parquet
+        self._frame = frame
+        self._arrays = {}
+        self._series = {}
+        if frame is not None:
+            self.columns = list(frame.columns)
+            self._rows = len(frame)
+        elif parquet is not None:
+            metadata = pq.ParquetFile(self._parquet_source())
+            self.columns = metadata.schema_arrow.names
+            self._rows = metadata.metadata.num_rows
+        else:
+            self.columns = table.column_names
+            self._rows = table.num_rows
+            self._arrays = dict(zip(table.column_names, table.columns))
+
+    @classmethod
+    def from_frame(cls, df):
+        if HAS_PARQUET:
+            try:
+                return cls(table=pa.Table.from_pandas(df, preserve_index=False))
+            except (ValueError, TypeError):
+                # e.g. object columns mixing numbers and text
+                pass
+        return cls(frame=df)
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def is_arrow(self):
+        return self._frame is None
+
+    @property
+    def loaded_columns(self):
+        return list(self.columns) if self._frame is not None else list(self._arrays)
+
+    def memory_bytes(self):
+        # Columns held in memory, not counting pandas copies of text columns made by ``read``.
+        # A Parquet file is memory-mapped as columns are read, so it counts as its size
+        if self._frame is not None:
+            return frame_memory(self._frame)
+        if isinstance(self._parquet, pa.Buffer):
+            encoded = self._parquet.size
+        else:
+            encoded = os.path.getsize(self._parquet) if self._parquet is not None else 0
+        with self._lock:
+            return encoded + int(sum(array.nbytes for array in self._arrays.values()))
+
+    def to_arrow(self):
+        with self._lock:
+            self._load(self.columns)
+            return pa.table([self._arrays[column] for column in self.columns], names=self.columns)
+
+    def _parquet_source(self):
+        return pa.BufferReader(self._parquet) if isinstance(self._parquet, pa.Buffer) else self._parquet
+
+    def _load(self, columns):
+        unread = [column for column in columns if column not in self._arrays]
+        if unread:
+            table = pq.read_table(self._parquet_source(), columns=unread, memory_map=True)
+            self._arrays.update(zip(unread, table.columns))
+
+    def read(self, columns):
+        """A pandas frame of just ``columns``, in that order."""
+        columns = list(dict.fromkeys(columns))
+        if self._frame is not None:
+            return self._frame[columns].copy(deep=False)
+        with self._lock:
+            missing = [column for column in columns if column not in self._series]
+            if missing:
+                self._load(missing)
+                converted = pa.table([self._arrays[column] for column in missing], names=missing)
+                self._series.update(converted.to_pandas(split_blocks=True).items())
+            return pd.DataFrame({column: self._series[column] for column in columns},
+                                index=pd.RangeIndex(self._rows), copy=False)
+
+    def head(self, n=5):
+        if self._frame is not None:
+            return self._frame.head(n)
+        if self._parquet is not None and not all(column in self._arrays for column in self.columns):
+            batch = next(pq.ParquetFile(self._parquet_source()).iter_batches(batch_size=n), None)
+            return pa.Table.from_batches([batch]).to_pandas() if batch is not None else self.read(self.columns)
+        return pa.table([self._arrays[column].slice(0, n) for column in self.columns], names=self.columns).to_pandas()
+
+
+def file_format(data):
+    # From the magic bytes, so uploads and paths don't depend on their file extension
+    if data[:4] == b'PAR1':
+        return 'parquet'
+    if data[:6] == b'ARROW1' or data[:4] == b'FEA1':
+        return 'feather'
+    if data[:4] == b'\xff\xff\xff\xff':
+        return 'arrow'
+    return 'csv'
+
+
+def read_columnar(data, fmt, max_rows=None, random_state=42):
+    """Parquet, Feather or Arrow IPC stream bytes as an Arrow table, plus the same stats as the CSV parsers.
+
+    Uncompressed Feather and Arrow streams are read zero-copy from ``data``.
+    With ``max_rows`` a uniform random sample of rows is kept, in file order.
+    """
+    if not HAS_PARQUET:
+        raise ValueError(f'Reading {fmt} files needs pyarrow')
+    source = pa.BufferReader(pa.py_buffer(data))
+    if fmt == 'parquet':
+        table = pq.read_table(source)
+    elif fmt == 'feather':
+        table = feather.read_table(source)
+    else:
+        table = pa.ipc.open_stream(source).read_all()
+    rows_read = table.num_rows
+    sampled = max_rows is not None and rows_read > max_rows
+    if sampled:
+        rng = np.random.default_rng(random_state)
+        table = table.take(np.sort(rng.choice(rows_read, max_rows, replace=False)))
+    stats = {'rows_read': rows_read, 'rows_kept': table.num_rows, 'sampled': sampled,
+             'memory_bytes': table.nbytes, 'peak_bytes': table.nbytes + (len(data) if sampled else 0)}
+    return table, stats
+
+
+def _parquet_path(key):
+    return os.path.join(CACHE_DIR, f'{key}.parquet')
+
+
+def _read_disk_cache(key):
+    """``(store, stats)`` from the Parquet cache, or None. ``stats`` are the row counts saved with the file."""
+    if not HAS_PARQUET:
+        return None
+    path = _parquet_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        # Only the schema is read here, columns are loaded as they are used
+        store = ColumnStore(parquet=path)
+        touch(path)
+        saved = json.loads((pq.read_schema(path).metadata or {}).get(STATS_METADATA_KEY, b'{}'))
+    except (OSError, ValueError):
+        return None
+    # Files cached before the stats were saved don't know whether they were sampled
+    stats = {'rows_read': saved.get('rows_read'), 'rows_kept': len(store), 'sampled': saved.get('sampled'),
+             'memory_bytes': store.memory_bytes(), 'peak_bytes': store.memory_bytes()}
+    return store, stats
+
+
+def _write_disk_cache(key, store, stats):
+    if not store.is_arrow:
+        return
+    path = _parquet_path(key)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        table = store.to_arrow()
+        metadata = {**(table.schema.metadata or {}),
+                    STATS_METADATA_KEY: json.dumps({name: stats[name] for name in ('rows_read', 'sampled')})}
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+        # Stores still open in memory read their columns from these files lazily
+        in_use = [store._parquet for store, _ in _stores.values() if isinstance(store._parquet, str)]
+        prune_disk_cache(CACHE_DIR, DATA_DISK_BYTES, suffix='.parquet', keep=in_use)
+    except (OSError, ValueError, TypeError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_store(uploaded_file, streaming=False, chunksize=CHUNK_ROWS, max_rows=None):
+    """Return ``(key, store, stats)`` for an uploaded file, parsing it at most once per content hash.
+
+    CSV, Parquet, Feather and Arrow IPC stream files are accepted. With
+    ``streaming`` a CSV is read in chunks into downcast/categorical columns;
+    ``max_rows`` then keeps a random sample of rows (for columnar files too).
+    Parsed CSVs are also cached on disk as compressed Parquet, least recently
+    used files first removed beyond ``DATA_DISK_BYTES``.
+    """
+    key, fmt = upload_hash(uploaded_file)
+    if fmt == 'csv' and streaming:
+        key = f'{key}-stream-{chunksize}-{max_rows}'
+    elif fmt != 'csv' and max_rows:
+        key = f'{key}-sample-{max_rows}'
+
+    entry = _stores.get(key)
+    if entry is None:
+        # Only a cache miss copies the upload's bytes
+        data = uploaded_file.getvalue()
+        cached = _read_disk_cache(key) if fmt == 'csv' else None
+        if cached is not None:
+            store, stats = cached
+        elif fmt == 'parquet' and not max_rows:
+            # Kept encoded and compressed; each column is decoded when a step first reads it
+            store = ColumnStore(parquet=pa.py_buffer(data))
+            stats = {'rows_read': len(store), 'rows_kept': len(store), 'sampled': False,
+                     'memory_bytes': len(data), 'peak_bytes': len(data)}
+        elif fmt != 'csv':
+            with stage(f'read {fmt}'):
+                table, stats = read_columnar(data, fmt, max_rows=max_rows)
+            store = ColumnStore(table=table)
+        else:
+            if streaming:
+                with stage('parse CSV', streaming=True):
+                    df, stats = parse_csv_chunked(data, chunksize=chunksize, max_rows=max_rows)
+            else:
+                with stage('parse CSV'):
+                    df = parse_csv(data)
+                stats = {'rows_read': len(df), 'rows_kept': len(df), 'sampled': False,
+                         'memory_bytes': frame_memory(df), 'peak_bytes': frame_memory(df)}
+            with stage('columnar store'):
+                store = ColumnStore.from_frame(df)
+            # The parsed frame is dropped, only the columnar copy stays resident
+            stats['memory_bytes'] = store.memory_bytes()
+            stats['peak_bytes'] = max(stats['peak_bytes'], stats['memory_bytes'] + frame_memory(df))
+            del df
+            _write_disk_cache(key, store, stats)
+        entry = (store, stats)
+        _stores.put(key, entry)
+    store, stats = entry
+    return key, store, dict(stats)
+
+
+def load_dataset(uploaded_file, streaming=False, chunksize=CHUNK_ROWS, max_rows=None):
+    """Return ``(key, df, stats)`` with every column; see ``load_store``."""
+    key, store, stats = load_store(uploaded_file, streaming=streaming, chunksize=chunksize, max_rows=max_rows)
+    return key, store.read(store.columns), stats
+
+
+def project(source, columns):
+    """Only ``columns`` of a ``ColumnStore`` or a frame, read from the store without touching the rest."""
+    columns = list(dict.fromkeys(columns))
+    return source.read(columns) if isinstance(source, ColumnStore) else source[columns]
@@ -0,0 +1,194 @@
+"""Per-stage wall time, CPU time and memory for one run of the app (or the CLI).
+
+    recorder = Recorder(trace_memory=True)
+    with recorder.active():
+        with stage('fit'):
+            ...
+
+``stage`` is a no-op when no recorder is active in the current thread, so
+library code can be instrumented unconditionally. Work handed to other
+threads records into a recorder passed along explicitly (see ``traced``).
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+_local = threading.local()
+_tracing_lock = threading.Lock()
+_tracing_started = False
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+def _rss_bytes():
+    # Current resident set size; Linux only, None elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS; None where there is no resource module
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _set_tracing(enabled):
+    # tracemalloc is process-wide; only stop it if it was started here
+    global _tracing_started
+    with _tracing_lock:
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        elif not enabled and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+class Recorder:
+    """Collects one record per stage: start, wall time, CPU time, RSS and allocation peak.
+
+    With ``trace_memory`` tracemalloc runs while the recorder exists (this
+    slows allocation-heavy code noticeably) and each stage gets the peak
+    traced allocation reached inside it, nested stages included. CPU time and
+    both memory figures are process-wide, so stages overlapping in other
+    threads (e.g. plot renders) are counted too.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        _set_tracing(trace_memory)
+        self.origin = time.perf_counter()
+        self.records = []
+        self._lock = threading.Lock()
+        self._stacks = {}
+
+    @contextmanager
+    def active(self):
+        previous = current()
+        _local.recorder = self
+        try:
+            yield self
+        finally:
+            _local.recorder = previous
+
+    @contextmanager
+    def stage(self, name, **args):
+        thread = threading.get_ident()
+        stack = self._stacks.setdefault(thread, [])
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # Keep the enclosing stage's peak before resetting it for this one
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {'peak': tracemalloc.get_traced_memory()[0] if tracing else 0}
+        stack.append(frame)
+        rss_before = _rss_bytes()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+            stack.pop()
+            record = {
+                'stage': name,
+                'thread': threading.current_thread().name,
+                'tid': thread,
+                'depth': len(stack),
+                'start_s': start - self.origin,
+                'wall_s': wall,
+                'cpu_s': cpu,
+                'rss_mb': None,
+                'rss_delta_mb': None,
+                'peak_rss_mb': None,
+                'peak_alloc_mb': None,
+                'args': args,
+            }
+            peak_rss = _peak_rss_bytes()
+            if peak_rss is not None:
+                record['peak_rss_mb'] = peak_rss / 2**20
+            rss_after = _rss_bytes()
+            if rss_after is not None:
+                record['rss_mb'] = rss_after / 2**20
+                record['rss_delta_mb'] = (rss_after - rss_before) / 2**20
+            if tracing:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_alloc_mb'] = peak / 2**20
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            with self._lock:
+                self.records.append(record)
+
+    def table(self):
+        """Stages in start order, indented by nesting depth."""
+        with self._lock:
+            records = sorted(self.records, key=lambda record: record['start_s'])
+        if not records:
+            return pd.DataFrame()
+        table = pd.DataFrame(records).drop(columns=['tid', 'args'])
+        table['stage'] = ['  ' * depth + name for depth, name in zip(table.pop('depth'), table['stage'])]
+        return table.set_index('stage')
+
+    def to_json(self):
+        with self._lock:
+            records = sorted(self.records, key=lambda record: record['start_s'])
+        return json.dumps({'trace_memory': self.trace_memory, 'stages': records}, indent=2, default=str)
+
+    def to_chrome_trace(self):
+        """Complete ("X") events for chrome://tracing or Perfetto, in microseconds."""
+        pid = os.getpid()
+        with self._lock:
+            records = list(self.records)
+        events = [{
+            'name': record['stage'],
+            'ph': 'X',
+            'ts': record['start_s'] * 1e6,
+            'dur': record['wall_s'] * 1e6,
+            'pid': pid,
+            'tid': record['tid'],
+            'args': {key: record[key] for key in ('cpu_s', 'rss_mb', 'rss_delta_mb', 'peak_alloc_mb')}
+            | {key: str(value) for key, value in record['args'].items()},
+        } for record in records]
+        threads = {record['tid']: record['thread'] for record in records}
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                   for tid, name in threads.items()]
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+
+@contextmanager
+def stage(name, **args):
+    """Record ``name`` in the current thread's active recorder, if there is one."""
+    recorder = current()
+    if recorder is None:
+        yield
+        return
+    with recorder.stage(name, **args):
+        yield
+
+
+def traced(recorder, name, function, *args, **kwargs):
+    """Run ``function`` as stage ``name`` of ``recorder``, from any thread."""
+    if recorder is None:
+        return function(*args, **kwargs)
+    with recorder.active(), recorder.stage(name):
+        return function(*args, **kwargs)
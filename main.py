@@ -1,189 +1,337 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
 from sklearn.linear_model import LogisticRegression, LinearRegression
-from sklearn.svm import SVC
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, mean_squared_error, mean_absolute_error,r2_score
-from sklearn.metrics import confusion_matrix, roc_curve, precision_recall_curve
-from sklearn.tree import plot_tree
-from sklearn.preprocessing import OneHotEncoder
 import numpy as np
 
+from analysis import POINT_BUDGET, cached_sample
+from curves import score_curves
+from incremental import INCREMENTAL_MODELS, get_session
+from ingest import load_dataset, load_store, project
+from instrumentation import Recorder, stage
+from models import DEFAULT_PARAMS, MODEL_NAMES, compare_models, fit_predict, model_key, registry, score
+from neighbors import DEFAULT_PROBES, IVFKNeighborsClassifier, compare_to_exact
+from plots import (evaluation_plots, plot_column_histogram, plot_correlation, plot_pairs, plot_quantile_boxplot,
+                   plot_value_counts, submit_plot)
+from preprocessing import MAX_ONEHOT_CATEGORIES, SPARSE_MODELS, dense_columns, feature_matrix, has_sparse_columns, is_categorical, preprocess
+from profiling import MAX_VALUE_COUNTS, get_profiler
+from serving import ScoringModel
+from svm import SOLVERS as SVM_SOLVERS, ScalableSVC, kernel_solvers
+from trees import MAX_BINS, HistogramForestClassifier, HistogramTreeClassifier
+from tuning import SEARCH_SPACES, tune
+from validation import cross_validate
+
+
+def show_plots(plot_key, plots):
+    # Plots are only drawn once picked. Picked plots render concurrently in a background
+    # thread pool and their images are cached per (model, plot), so reruns don't redraw them
+    selected = st.multiselect('Show Plots', list(plots))
+    futures = [(title, submit_plot(plot_key, title, *plots[title])) for title in selected]
+    for title, future in futures:
+        st.write(f'#### {title}')
+        st.image(future.result())
+
+
+def export_button(model):
+    # The estimator and its preprocessing, ready for `python -m app serve`; only serialized once clicked
+    st.download_button('Export Fitted Model', model.to_bytes,
+                       file_name=f"{model.model_name.lower().replace(' ', '_')}.joblib")
+
+
+def show_performance(panel, recorder):
+    # Stages from parsing to the last plot of this rerun; cached stages don't appear or take ~0s
+    table = recorder.table()
+    if table.empty:
+        panel.write('No stages recorded yet')
+        return
+    panel.dataframe(table)
+    panel.download_button('Download JSON', recorder.to_json(), file_name='performance.json', mime='application/json')
+    panel.download_button('Download Chrome Trace', recorder.to_chrome_trace(), file_name='performance.trace.json',
+                          mime='application/json')
+
 
 def main():
+    # Every stage of the rerun is timed; the panel is filled in once the page is done
+    performance = st.sidebar.expander('Performance')
+    trace_memory = performance.checkbox('Trace Allocations (tracemalloc, slows the run)')
+    recorder = Recorder(trace_memory=trace_memory)
+    with recorder.active(), recorder.stage('rerun'):
+        evaluation_page()
+    show_performance(performance, recorder)
+
+
+def evaluation_page():
     # Main content
     st.title('Evaluation of supervised machine learning model')
     st.write('### Upload Dataset')
 
-    uploaded_file = st.file_uploader("Choose a CSV file", type=["csv"])
+    uploaded_file = st.file_uploader("Choose a CSV, Parquet, Feather or Arrow file", type=["csv", "parquet", "feather", "arrow"])
     if uploaded_file is not None:
-        # Load the dataset
-        df = pd.read_csv(uploaded_file)
+        # Streaming ingestion reads the file in chunks into compact dtypes
+        st.sidebar.title("Data Loading")
+        streaming = st.sidebar.checkbox("Streaming ingestion (compact dtypes)")
+        max_rows = 0
+        if streaming:
+            max_rows = st.sidebar.number_input("Max rows kept (0 = all, otherwise a random sample)", min_value=0, value=0, step=100000)
+
+        # Load the dataset into a columnar store (parsed once per file content, later reruns hit the
+        # cache). Only the columns a step uses are read from it into pandas
+        data_key, data, load_stats = load_store(uploaded_file, streaming=streaming, max_rows=max_rows or None)
         st.write('### Dataset')
-        st.write(df.head())
+        if load_stats['sampled']:
+            st.write(f"Using a random sample of {load_stats['rows_kept']:,} of {load_stats['rows_read']:,} rows")
+        st.write(f"Memory: {load_stats['memory_bytes'] / 2**20:.1f} MiB (peak while loading: {load_stats['peak_bytes'] / 2**20:.1f} MiB)")
+        preview = data.head()
+        st.write(preview)
 
     # Checkbox to trigger replacing null values and concatenating data
         st.sidebar.title("Data Preprocessing")
         preprocess_checkbox = st.sidebar.checkbox("Replace Null Values and Concatenate")
+        preprocessor = None
         if preprocess_checkbox:
-    # Fill null values with next valid observation
-            df.fillna(method='bfill', inplace=True)
+            max_categories = st.sidebar.slider("Max One-Hot Categories per Column", 2, 200, MAX_ONEHOT_CATEGORIES)
+    # Fill null values with next valid observation and one-hot encode into sparse columns,
+    # fitted once per dataset and options
+            preprocessor, data = preprocess(data_key, project(data, data.columns), max_categories=max_categories)
+            data_key = f'{data_key}:encoded:{max_categories}'
             st.write('### Null Values Replaced')
-            st.write(df.head())
+            st.write(preprocessor.filled_preview_)
 
-    # Perform one-hot encoding
-            df = pd.get_dummies(df)
             st.write('### Encoded Data')
-            st.write(df.head())
+            if preprocessor.hashed_columns_:
+                st.write(f"High-cardinality columns hashed into {preprocessor.hash_features} buckets: {', '.join(preprocessor.hashed_columns_)}")
+            preview = data.head()
+            st.write(dense_columns(preview, data.columns))
 
 
 
         # Data Analytics Section
         st.sidebar.title("Data Analysis")
-        selected_features = st.sidebar.multiselect("Select Features", df.columns)
+        selected_features = st.sidebar.multiselect("Select Features", data.columns)
+        point_budget = st.sidebar.number_input("Point Budget for Scatter Plots", min_value=100, value=POINT_BUDGET, step=1000)
+        stratify_column = st.sidebar.selectbox("Stratify Sample By", [None] + [column for column in data.columns if is_categorical(preview[column])])
         if selected_features:
             st.write("### Data Analysis")
+            analysis_columns = selected_features + ([stratify_column] if stratify_column and stratify_column not in selected_features else [])
+            analysis_df = dense_columns(project(data, analysis_columns), analysis_columns)
+            numeric_features = [feature for feature in selected_features
+                                if pd.api.types.is_numeric_dtype(analysis_df[feature]) and not pd.api.types.is_bool_dtype(analysis_df[feature])]
+            categorical_features = [feature for feature in selected_features if is_categorical(analysis_df[feature])]
+
+            # Scatter-type plots use a bounded sample; histograms, boxplots and counts are
+            # aggregated over every row first and only the aggregates are drawn
+            analysis_key = (data_key, point_budget, stratify_column)
+            sample = cached_sample((analysis_key, tuple(analysis_columns)), analysis_df, point_budget, stratify=stratify_column)
+            if len(sample) < len(analysis_df):
+                st.write(f"Scatter plots and density curves use a {'stratified' if stratify_column else 'random'} sample of {len(sample):,} of {len(analysis_df):,} rows")
+            figures = []
+
+            # Column statistics and correlations are computed once per column and reused,
+            # so changing the selection only profiles the newly added columns
+            profiler = get_profiler(data_key, data)
+            st.write("#### Column Profile")
+            with stage('profile'):
+                profile = profiler.profile(selected_features)
+            st.write(profile)
+
             # Distribution plots
-            for feature in selected_features:
-                if df[feature].dtype == 'int64' or df[feature].dtype == 'float64':
-                    st.write(f"#### {feature} Distribution")
-                    plt.figure(figsize=(8, 5))
-                    sns.histplot(df[feature], kde=True)
-                    plt.xlabel(feature)
-                    plt.ylabel("Frequency")
-                    st.pyplot()
-
-            # Boxplot for numerical features
-            st.write("#### Boxplot for Numerical Features")
-            plt.figure(figsize=(10, 6))
-            sns.boxplot(data=df[selected_features])
-            plt.xticks(rotation=45)
-            st.pyplot()
-
-            # Correlation Heatmap
-            st.write("#### Correlation Heatmap")
-            corr = df[selected_features].corr()
-            plt.figure(figsize=(10, 8))
-            sns.heatmap(corr, annot=True, cmap='coolwarm')
-            st.pyplot()
-
-            # Pairplot
-            st.write("#### Pairplot")
-            sns.pairplot(df[selected_features])
-            st.pyplot()
+            for feature in numeric_features:
+                figures.append((f"{feature} Distribution", submit_plot(
+                    analysis_key, f"hist:{feature}", plot_column_histogram, feature, analysis_df[feature], sample[feature])))
+
+            if numeric_features:
+                # Boxplot for numerical features
+                figures.append(("Boxplot for Numerical Features", submit_plot(
+                    analysis_key, f"box:{numeric_features}", plot_quantile_boxplot, profiler.box_stats(numeric_features))))
+
+                # Correlation Heatmap
+                figures.append(("Correlation Heatmap", submit_plot(
+                    analysis_key, f"corr:{numeric_features}", plot_correlation, profiler.correlation(numeric_features))))
+
+                # Pairplot
+                figures.append(("Pairplot", submit_plot(
+                    analysis_key, f"pairs:{numeric_features}", plot_pairs, sample[numeric_features])))
 
             # Countplots for categorical features
-            categorical_features = [feature for feature in selected_features if df[feature].dtype == 'object']
             for feature in categorical_features:
-                st.write(f"#### {feature} Countplot")
-                plt.figure(figsize=(8, 5))
-                sns.countplot(data=df, x=feature)
-                plt.xticks(rotation=45)
-                st.pyplot()
-
-       
+                counts = profiler.value_counts(feature)
+                if counts is None:
+                    st.write(f"#### {feature} Countplot")
+                    st.write(f"Skipped, {feature} has more than {MAX_VALUE_COUNTS:,} distinct values")
+                    continue
+                figures.append((f"{feature} Countplot", submit_plot(
+                    analysis_key, f"count:{feature}", plot_value_counts, counts.rename_axis(feature))))
+
+            for title, future in figures:
+                st.write(f"#### {title}")
+                st.image(future.result())
 
         C = 1.0  # Default value for C
+        histogram_trees = False
         # Sidebar - Model Selection and Hyperparameter Tuning
         st.sidebar.title('Model Configuration')
-        model_name = st.sidebar.selectbox('Select Model', ['Random Forest', 'Logistic Regression', 'SVM', 'K-Nearest Neighbors', 'Decision Tree', 'Linear Regression'])
+        model_name = st.sidebar.selectbox('Select Model', ['Random Forest', 'Logistic Regression', 'SVM', 'K-Nearest Neighbors', 'Decision Tree', 'Linear Regression', 'Gradient Boosting'])
+        params = dict(DEFAULT_PARAMS.get(model_name, {}))  # Hyperparameters as passed to the estimator
         if model_name == 'Random Forest':
             n_estimators = st.sidebar.slider('Number of Estimators', 1, 100, 10)
             max_depth = st.sidebar.slider('Max Depth', 1, 20, 10)
+            params = {'n_estimators': n_estimators, 'max_depth': max_depth}
+            # Features quantised to uint8 bins before fitting: fewer candidate splits to sort and scan
+            histogram_trees = st.sidebar.checkbox('Histogram Mode (binned features)')
+            if histogram_trees:
+                max_bins = st.sidebar.slider('Max Bins per Feature', 2, 255, MAX_BINS)
+                params['max_bins'] = max_bins
         elif model_name == 'SVM':
             C = st.sidebar.slider('Regularization Parameter (C)', 0.01, 10.0, 1.0)
             kernel = st.sidebar.selectbox('Kernel', ['linear', 'poly', 'rbf', 'sigmoid'])
+            # Only the solvers that can fit the chosen kernel are offered
+            svm_solver = st.sidebar.selectbox('Solver', kernel_solvers(kernel), format_func=SVM_SOLVERS.get)
+            params = {'C': C, 'kernel': kernel, 'solver': svm_solver}
         elif model_name == 'K-Nearest Neighbors':
             n_neighbors = st.sidebar.slider('Number of Neighbors', 1, 20, 5)
+            params = {'n_neighbors': n_neighbors}
+            approximate_knn = st.sidebar.checkbox('Approximate Neighbor Search (IVF index)')
+            if approximate_knn:
+                n_probe = st.sidebar.slider('Lists Probed (more = better recall, slower)', 1, 64, DEFAULT_PROBES)
+                params['n_probe'] = n_probe
         elif model_name == 'Decision Tree':
             max_depth = st.sidebar.slider('Max Depth', 1, 20, 10)
+            params = {'max_depth': max_depth}
+            histogram_trees = st.sidebar.checkbox('Histogram Mode (binned features)')
+            if histogram_trees:
+                max_bins = st.sidebar.slider('Max Bins per Feature', 2, 255, MAX_BINS)
+                params['max_bins'] = max_bins
         elif model_name == 'Gradient Boosting':
             n_estimators_gb = st.sidebar.slider('Number of Estimators', 1, 100, 10)
             learning_rate_gb = st.sidebar.slider('Learning Rate', 0.01, 1.0, 0.1)
+            params = {'max_iter': n_estimators_gb, 'learning_rate': learning_rate_gb}
 
         # Select features (X values)
-        target_column = st.sidebar.selectbox('Select Target Variable (y)', df.columns)
+        target_column = st.sidebar.selectbox('Select Target Variable (y)', data.columns)
 
          # Select target variable (y)
         
-        selected_features = st.sidebar.multiselect("Select Features (X)", [col for col in df.columns if col != target_column])
+        selected_features = st.sidebar.multiselect("Select Features (X)", [col for col in data.columns if col != target_column])
    
 
         # Train and evaluate the selected model
+        sparse_training = st.sidebar.checkbox("Sparse Training Matrix", value=True)
+        persist_models = st.sidebar.checkbox("Persist Fitted Models to Disk")
+        evaluation_mode = st.sidebar.radio('Evaluation', ['Holdout (80/20)', 'K-Fold Cross-Validation'])
+        n_folds = 5
+        if evaluation_mode == 'K-Fold Cross-Validation':
+            n_folds = st.sidebar.slider('Number of Folds', 3, 10, 5)
+        # Append-only data: update the model with new rows instead of refitting on everything
+        incremental_mode = st.sidebar.checkbox("Incremental Training (append new rows)")
+        new_rows_file = None
+        if incremental_mode:
+            new_rows_file = st.sidebar.file_uploader("New Rows (CSV, Parquet, Feather or Arrow)", type=["csv", "parquet", "feather", "arrow"])
         train_button = st.sidebar.button("Evaluate the model and Output plots")
+        compare_button = st.sidebar.button("Compare All Models")
+        tune_button = False
+        if model_name in SEARCH_SPACES:
+            n_candidates = st.sidebar.slider('Tuning Candidates', 8, 128, 32)
+            tune_button = st.sidebar.button("Tune Hyperparameters (Successive Halving)")
+
+        # The evaluation stays on screen across reruns (e.g. picking plots) until the configuration changes
+        run_key = model_key(data_key, selected_features, target_column, model_name, params, split_seed=42,
+                            sparse=sparse_training, evaluation=evaluation_mode, folds=n_folds)
         if train_button:
-            X = df[selected_features]
-            y = df[target_column]
+            st.session_state['evaluated_run'] = run_key
+        evaluate = st.session_state.get('evaluated_run') == run_key and not (compare_button or tune_button)
+        if evaluate or compare_button or tune_button:
+            # Encoded columns stay sparse (CSR) all the way into the estimator when it supports it
+            use_sparse = sparse_training and (compare_button or model_name in SPARSE_MODELS)
+            with stage('feature matrix'):
+                model_df = project(data, selected_features + [target_column])
+                X, feature_names = feature_matrix(model_df, selected_features, use_sparse=use_sparse)
+            if sparse_training and not use_sparse and has_sparse_columns(model_df, selected_features):
+                st.write(f'{model_name} does not accept sparse input, training on a dense matrix instead')
+            y = dense_columns(model_df, [target_column])[target_column]
 
             # Split data into training and testing sets
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-            if model_name == 'Random Forest':
+            with stage('split'):
+                X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+            # Fitted models are cached per configuration, so re-evaluating an unchanged one skips the fit
+            def fit_key(params):
+                return model_key(data_key, feature_names, target_column, model_name, params, split_seed=42, sparse=use_sparse)
+
+            # Folds run in parallel worker processes that share X through memory maps
+            if evaluate and evaluation_mode == 'K-Fold Cross-Validation':
+                st.write(f'### {n_folds}-Fold Cross-Validation')
+                if st.session_state.get('cv_run') != run_key:
+                    with stage('cross-validation', folds=n_folds):
+                        st.session_state['cv_results'] = cross_validate(model_name, params, X, y, n_splits=n_folds)
+                    st.session_state['cv_run'] = run_key
+                per_fold, cv_summary = st.session_state['cv_results']
+                st.write('#### Per-Fold Metrics')
+                st.write(per_fold)
+                st.write('#### Aggregate Metrics')
+                st.write(cv_summary)
+
+            if compare_button:
+                # Fit every model with its default settings in a process pool, filling the
+                # leaderboard as each one finishes
+                st.write('### Model Comparison')
+                leaderboard = st.empty()
+                # Models without sparse support are fitted on a dense copy, and keyed as such
+                configs = {name: (model_key(data_key, feature_names, target_column, name, DEFAULT_PARAMS[name], split_seed=42,
+                                            sparse=use_sparse and name in SPARSE_MODELS),
+                                  DEFAULT_PARAMS[name])
+                           for name in MODEL_NAMES}
+                rows = []
+                with stage('compare models'):
+                    for row in compare_models(configs, X_train, y_train, X_test, y_test, persist=persist_models):
+                        rows.append(row)
+                        leaderboard.dataframe(pd.DataFrame(rows).sort_values(['Metric', 'Score'], ascending=[True, False], na_position='last'))
+
+            elif tune_button:
+                # Random search over the slider ranges, dropping weak candidates on growing subsamples
+                st.write(f'### {model_name} Hyperparameter Tuning')
+                with stage('tune', candidates=n_candidates):
+                    result = tune(model_name, X_train, y_train, n_candidates=n_candidates)
+                best_estimator = result['best_estimator']
+                y_pred = best_estimator.predict(X_test)
+                registry.put(fit_key(result['best_params']), best_estimator, y_pred, persist=persist_models)
+                metric, value = score(model_name, y_test, y_pred)
+                st.write(f"Best Configuration: {result['best_params']}")
+                st.write(f"Cross-validated {metric}: {result['best_score']:.2f} ({result['n_rounds']} halving rounds)")
+                st.write(f'Test {metric}: {value:.2f}')
+                st.dataframe(result['results'].assign(params=result['results']['params'].astype(str)))
+
+            elif model_name == 'Random Forest':
                 st.write('### Random Forest Configuration')
                 st.write(f'Number of Estimators: {n_estimators}')
                 st.write(f'Max Depth: {max_depth}')
-
-                # Train the model
-                rf_classifier = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42)
-                rf_classifier.fit(X_train, y_train)
+                if histogram_trees:
+                    st.write(f'Histogram Mode: up to {max_bins} bins per feature')
+
+                # Train the model on every core
+                if histogram_trees:
+                    rf_estimator = HistogramForestClassifier(n_estimators=n_estimators, max_depth=max_depth, max_bins=max_bins)
+                else:
+                    rf_estimator = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42, n_jobs=-1)
+                rf_classifier, y_pred, cached = fit_predict(
+                    fit_key(params), rf_estimator,
+                    X_train, y_train, X_test, persist=persist_models)
+                if cached:
+                    st.write('Using the cached fitted model for this configuration')
 
                 # Evaluate the model
-                y_pred = rf_classifier.predict(X_test)
                 accuracy = accuracy_score(y_test, y_pred)
                 st.write('### Model Evaluation')
                 st.write(f'Accuracy: {accuracy:.2f}')
 
+                export_button(ScoringModel(model_name, rf_classifier, selected_features, target_column, preprocessor, use_sparse))
 
-                # Additional plots
-    # Plot 1: Confusion Matrix
-                fig1, ax1 = plt.subplots()
-                cm = confusion_matrix(y_test, y_pred)
-                sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', cbar=False)
-                plt.xlabel('Predicted')
-                plt.ylabel('Actual')
-                plt.title('Confusion Matrix')
-                st.pyplot(fig1)
-
-    # Plot 2: ROC Curve
-                fig2, ax2 = plt.subplots()
-                fpr, tpr, thresholds = roc_curve(y_test, y_pred)
-                plt.plot(fpr, tpr, color='blue', lw=2)
-                plt.plot([0, 1], [0, 1], color='red', lw=2, linestyle='--')
-                plt.xlabel('False Positive Rate')
-                plt.ylabel('True Positive Rate')
-                plt.title('ROC Curve')
-                st.pyplot(fig2)
-
-    # Plot 3: Precision-Recall Curve
-                fig3, ax3 = plt.subplots()
-                precision, recall, _ = precision_recall_curve(y_test, y_pred)
-                plt.plot(recall, precision, color='green', lw=2)
-                plt.xlabel('Recall')
-                plt.ylabel('Precision')
-                plt.title('Precision-Recall Curve')
-                st.pyplot(fig3)
-
-    # Plot 4: Probability Distributions of Predicted Classes
-                fig4, ax4 = plt.subplots()
-                sns.kdeplot(y_pred[y_test == 0], label='Class 0', shade=True)
-                sns.kdeplot(y_pred[y_test == 1], label='Class 1', shade=True)
-                plt.xlabel('Predicted Probability')
-                plt.ylabel('Density')
-                plt.title('Probability Distributions of Predicted Classes')
-                plt.legend()
-                st.pyplot(fig4)
-  
-    # Plot 5: Decision Boundaries (2D)
-                if X_train.shape[1] == 2:  # Only plot if there are 2 features
-                    fig5, ax5 = plt.subplots()
-                    plot_decision_boundaries(rf_classifier, X_train, y_train, ax=ax5)
-                    ax5.set_title('Decision Boundaries')
-                    st.pyplot(fig5)
+    # Plots
+                show_plots(run_key, evaluation_plots(model_name, rf_classifier, X_train, y_train, X_test, y_test, y_pred, feature_names,
+                                                     curves=score_curves(run_key, rf_classifier, X_test, y_test)))
 
             elif model_name == 'Logistic Regression':
                 
@@ -192,72 +340,23 @@ def main():
                 st.write(f'Regularization Parameter (C): {C}')
 
     # Train the model
-                log_reg = LogisticRegression(C=C, random_state=42)
-                log_reg.fit(X_train, y_train)
+                log_reg, y_pred, cached = fit_predict(
+                    fit_key({'C': C}), LogisticRegression(C=C, random_state=42),
+                    X_train, y_train, X_test, persist=persist_models)
+                if cached:
+                    st.write('Using the cached fitted model for this configuration')
 
     # Evaluate the model
                
-                y_pred = log_reg.predict(X_test)
                 accuracy = accuracy_score(y_test, y_pred)
                 st.write('### Model Evaluation')
                 st.write(f'Accuracy: {accuracy}')
 
-    # Plot feature coefficients for Logistic Regression
-                coefficients = log_reg.coef_[0]
-                plt.figure(figsize=(10, 6))
-                sns.barplot(x=coefficients, y=X.columns)
-                plt.xlabel('Coefficient Value')
-                plt.ylabel('Features')
-                plt.title('Feature Coefficients')
-                st.pyplot()
-
-    # Additional plots
-    # Plot 1: Confusion Matrix
-                fig1, ax1 = plt.subplots()
-                cm = confusion_matrix(y_test, y_pred)
-                sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', cbar=False)
-                plt.xlabel('Predicted')
-                plt.ylabel('Actual')
-                plt.title('Confusion Matrix')
-                st.pyplot(fig1)
-
-    # Plot 2: ROC Curve
-                fig2, ax2 = plt.subplots()
-                fpr, tpr, thresholds = roc_curve(y_test, y_pred)
-                plt.plot(fpr, tpr, color='blue', lw=2)
-                plt.plot([0, 1], [0, 1], color='red', lw=2, linestyle='--')
-                plt.xlabel('False Positive Rate')
-                plt.ylabel('True Positive Rate')
-                plt.title('ROC Curve')
-                st.pyplot(fig2)
-
-    # Plot 3: Precision-Recall Curve
-                fig3, ax3 = plt.subplots()
-                precision, recall, _ = precision_recall_curve(y_test, y_pred)
-                plt.plot(recall, precision, color='green', lw=2)
-                plt.xlabel('Recall')
-                plt.ylabel('Precision')
-                plt.title('Precision-Recall Curve')
-                st.pyplot(fig3)
-
-    # Plot 4: Probability Distributions of Predicted Classes
-                fig4, ax4 = plt.subplots()
-                sns.kdeplot(y_pred[y_test == 0], label='Class 0', shade=True)
-                sns.kdeplot(y_pred[y_test == 1], label='Class 1', shade=True)
-                plt.xlabel('Predicted Probability')
-                plt.ylabel('Density')
-                plt.title('Probability Distributions of Predicted Classes')
-                plt.legend()
-                st.pyplot(fig4)
-
-    # Plot 5: Scatter Plot of Actual vs Predicted
-                fig5, ax5 = plt.subplots()
-                ax5.scatter(y_test, y_pred, color='blue')
-                ax5.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'k--', lw=4)
-                ax5.set_xlabel('Actual')
-                ax5.set_ylabel('Predicted')
-                ax5.set_title('Actual vs Predicted')
-                st.pyplot(fig5)
+                export_button(ScoringModel(model_name, log_reg, selected_features, target_column, preprocessor, use_sparse))
+
+    # Plots
+                show_plots(run_key, evaluation_plots(model_name, log_reg, X_train, y_train, X_test, y_test, y_pred, feature_names,
+                                                     curves=score_curves(run_key, log_reg, X_test, y_test)))
 
             elif model_name == 'SVM':
                 st.write('### SVM Configuration')
@@ -265,217 +364,128 @@ def main():
                 st.write(f'Kernel: {kernel}')
 
     # Train the model
-                C = 1.0  # Default value for C
-                svm_classifier = SVC(C=C, kernel=kernel, random_state=42)
-                svm_classifier.fit(X_train, y_train)
+                # Large training sets switch to a linear or kernel-approximation solver
+                svm_classifier, y_pred, cached = fit_predict(
+                    fit_key(params), ScalableSVC(C=C, kernel=kernel, solver=svm_solver, random_state=42),
+                    X_train, y_train, X_test, persist=persist_models)
+                if cached:
+                    st.write('Using the cached fitted model for this configuration')
+                st.write(f'Solver: {SVM_SOLVERS[svm_classifier.solver_]}')
+                st.write(f'Fit Time: {svm_classifier.fit_time_:.2f} s')
 
     # Evaluate the model
          
-                y_pred = svm_classifier.predict(X_test)
                 accuracy = accuracy_score(y_test, y_pred)
                 st.write('### Model Evaluation')
                 st.write(f'Accuracy: {accuracy:.2f}')
 
-    # Plot feature coefficients for SVM (absolute values)
-                coefficients = np.abs(svm_classifier.coef_.flatten())  # Taking absolute values of coefficients
-    # Ensure the lengths of coefficients and feature names match
-                if len(coefficients) == len(X.columns):
-                    fig1, ax1 = plt.subplots(figsize=(10, 6))
-                    sns.barplot(x=coefficients, y=X.columns, ax=ax1)
-                    ax1.set_xlabel('Absolute Coefficient Value')
-                    ax1.set_ylabel('Features')
-                    ax1.set_title('Feature Coefficients (Absolute Values)')
-                    st.pyplot(fig1)
-    # Additional plots
-    # Plot 1: Confusion Matrix
-                    fig2, ax2 = plt.subplots()
-                    cm = confusion_matrix(y_test, y_pred)
-                    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', cbar=False)
-                    plt.xlabel('Predicted')
-                    plt.ylabel('Actual')
-                    plt.title('Confusion Matrix')
-                    st.pyplot(fig2)
-
-    # Plot 2: ROC Curve
-                    fig3, ax3 = plt.subplots()
-                    fpr, tpr, thresholds = roc_curve(y_test, y_pred)
-                    plt.plot(fpr, tpr, color='blue', lw=2)
-                    plt.plot([0, 1], [0, 1], color='red', lw=2, linestyle='--')
-                    plt.xlabel('False Positive Rate')
-                    plt.ylabel('True Positive Rate')
-                    plt.title('ROC Curve')
-                    st.pyplot(fig3)
-
-    # Plot 3: Precision-Recall Curve
-                    fig4, ax4 = plt.subplots()
-                    precision, recall, _ = precision_recall_curve(y_test, y_pred)
-                    plt.plot(recall, precision, color='green', lw=2)
-                    plt.xlabel('Recall')
-                    plt.ylabel('Precision')
-                    plt.title('Precision-Recall Curve')
-                    st.pyplot(fig4)
-
-    # Plot 4: Probability Distributions of Predicted Classes
-                    fig5, ax5 = plt.subplots()
-                    sns.kdeplot(y_pred[y_test == 0], label='Class 0', shade=True)
-                    sns.kdeplot(y_pred[y_test == 1], label='Class 1', shade=True)
-                    plt.xlabel('Predicted Probability')
-                    plt.ylabel('Density')
-                    plt.title('Probability Distributions of Predicted Classes')
-                    plt.legend()
-                    st.pyplot(fig5)
-
-    # Plot 5: Scatter Plot of Actual vs Predicted
-                    fig6, ax6 = plt.subplots()
-                    ax6.scatter(y_test, y_pred, color='blue')
-                    ax6.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'k--', lw=4)
-                    ax6.set_xlabel('Actual')
-                    ax6.set_ylabel('Predicted')
-                    ax6.set_title('Actual vs Predicted')
-                    st.pyplot(fig6)
+                export_button(ScoringModel(model_name, svm_classifier, selected_features, target_column, preprocessor, use_sparse))
+
+    # Plots
+                show_plots(run_key, evaluation_plots(model_name, svm_classifier, X_train, y_train, X_test, y_test, y_pred, feature_names,
+                                                     curves=score_curves(run_key, svm_classifier, X_test, y_test)))
 
-                
             elif model_name == 'K-Nearest Neighbors':
                 st.write('### K-Nearest Neighbors Configuration')
                 st.write(f'Number of Neighbors: {n_neighbors}')
+                if approximate_knn:
+                    st.write(f'Approximate Search: {n_probe} lists probed')
 
     # Train the model
-                knn_classifier = KNeighborsClassifier(n_neighbors=n_neighbors)
-                knn_classifier.fit(X_train, y_train)
+                if approximate_knn:
+                    # The index depends only on the training set, so changing k or n_probe reuses it
+                    knn_estimator = IVFKNeighborsClassifier(n_neighbors=n_neighbors, n_probe=n_probe, index_key=fit_key({}))
+                else:
+                    knn_estimator = KNeighborsClassifier(n_neighbors=n_neighbors)
+                knn_classifier, y_pred, cached = fit_predict(
+                    fit_key(params), knn_estimator,
+                    X_train, y_train, X_test, persist=persist_models)
+                if cached:
+                    st.write('Using the cached fitted model for this configuration')
 
     # Evaluate the model
                
-                y_pred = knn_classifier.predict(X_test)
                 accuracy = accuracy_score(y_test, y_pred)
                 st.write('### Model Evaluation')
                 st.write(f'Accuracy: {accuracy:.2f}')
+                if approximate_knn:
+                    # Exact search on a sample of the test rows, to show what the approximation costs
+                    st.write('#### Approximate vs Exact Search')
+                    if st.session_state.get('knn_exact_run') != run_key:
+                        st.session_state['knn_exact'] = compare_to_exact(knn_classifier, X_train, y_train, X_test, y_test)
+                        st.session_state['knn_exact_run'] = run_key
+                    st.write(pd.Series(st.session_state['knn_exact'], name='Value'))
 
-    # Additional plots
-    # Plot 1: Confusion Matrix
-                fig1, ax1 = plt.subplots()
-                cm = confusion_matrix(y_test, y_pred)
-                sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', cbar=False)
-                plt.xlabel('Predicted')
-                plt.ylabel('Actual')
-                plt.title('Confusion Matrix')
-                st.pyplot(fig1)
-
-    # Plot 2: ROC Curve
-                fig2, ax2 = plt.subplots()
-                fpr, tpr, thresholds = roc_curve(y_test, y_pred)
-                plt.plot(fpr, tpr, color='blue', lw=2)
-                plt.plot([0, 1], [0, 1], color='red', lw=2, linestyle='--')
-                plt.xlabel('False Positive Rate')
-                plt.ylabel('True Positive Rate')
-                plt.title('ROC Curve')
-                st.pyplot(fig2)
-
-    # Plot 3: Precision-Recall Curve
-                fig3, ax3 = plt.subplots()
-                precision, recall, _ = precision_recall_curve(y_test, y_pred)
-                plt.plot(recall, precision, color='green', lw=2)
-                plt.xlabel('Recall')
-                plt.ylabel('Precision')
-                plt.title('Precision-Recall Curve')
-                st.pyplot(fig3)
-
-    # Plot 4: Scatter Plot of Actual vs Predicted
-                fig4, ax4 = plt.subplots()
-                ax4.scatter(y_test, y_pred, color='blue')
-                ax4.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'k--', lw=4)
-                ax4.set_xlabel('Actual')
-                ax4.set_ylabel('Predicted')
-                ax4.set_title('Actual vs Predicted')
-                st.pyplot(fig4)
-
-    # Plot 5: Decision Boundaries (2D)
-                if X_train.shape[1] == 2:  # Only plot if there are 2 features
-                    fig5, ax5 = plt.subplots()
-                    plot_decision_boundaries(knn_classifier, X_train, y_train, ax=ax5)
-                    ax5.set_title('Decision Boundaries')
-                    st.pyplot(fig5)
+                export_button(ScoringModel(model_name, knn_classifier, selected_features, target_column, preprocessor, use_sparse))
 
+    # Plots
+                show_plots(run_key, evaluation_plots(model_name, knn_classifier, X_train, y_train, X_test, y_test, y_pred, feature_names,
+                                                     curves=score_curves(run_key, knn_classifier, X_test, y_test)))
 
             elif model_name == 'Decision Tree':
                 st.write('### Decision Tree Configuration')
                 st.write(f'Max Depth: {max_depth}')
+                if histogram_trees:
+                    st.write(f'Histogram Mode: up to {max_bins} bins per feature')
 
     # Train the model
-                dt_classifier = DecisionTreeClassifier(max_depth=max_depth, random_state=42)
-                dt_classifier.fit(X_train, y_train)
+                if histogram_trees:
+                    dt_estimator = HistogramTreeClassifier(max_depth=max_depth, max_bins=max_bins)
+                else:
+                    dt_estimator = DecisionTreeClassifier(max_depth=max_depth, random_state=42)
+                dt_classifier, y_pred, cached = fit_predict(
+                    fit_key(params), dt_estimator,
+                    X_train, y_train, X_test, persist=persist_models)
+                if cached:
+                    st.write('Using the cached fitted model for this configuration')
 
     # Evaluate the model
            
-                y_pred = dt_classifier.predict(X_test)
                 accuracy = accuracy_score(y_test, y_pred)
                 st.write('### Model Evaluation')
                 st.write(f'Accuracy: {accuracy:.2f}')
 
-    # Plot feature importances
-                feature_importances = dt_classifier.feature_importances_
-                plt.figure(figsize=(10, 6))
-                sns.barplot(x=feature_importances, y=X.columns)
-                plt.xlabel('Feature Importance')
-                plt.ylabel('Features')
-                plt.title('Feature Importances')
-                st.pyplot()
-
-    # Additional plots
-    # Plot 1: Confusion Matrix
-                fig1, ax1 = plt.subplots()
-                cm = confusion_matrix(y_test, y_pred)
-                sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', cbar=False)
-                plt.xlabel('Predicted')
-                plt.ylabel('Actual')
-                plt.title('Confusion Matrix')
-                st.pyplot(fig1)
-
-    # Plot 2: ROC Curve
-                fig2, ax2 = plt.subplots()
-                fpr, tpr, thresholds = roc_curve(y_test, y_pred)
-                plt.plot(fpr, tpr, color='blue', lw=2)
-                plt.plot([0, 1], [0, 1], color='red', lw=2, linestyle='--')
-                plt.xlabel('False Positive Rate')
-                plt.ylabel('True Positive Rate')
-                plt.title('ROC Curve')
-                st.pyplot(fig2)
-
-    # Plot 3: Precision-Recall Curve
-                fig3, ax3 = plt.subplots()
-                precision, recall, _ = precision_recall_curve(y_test, y_pred)
-                plt.plot(recall, precision, color='green', lw=2)
-                plt.xlabel('Recall')
-                plt.ylabel('Precision')
-                plt.title('Precision-Recall Curve')
-                st.pyplot(fig3)
-
-    # Plot 4: Decision Tree Visualization
-                fig4, ax4 = plt.subplots()
-                plot_tree(dt_classifier, feature_names=X.columns, filled=True)
-                plt.title('Decision Tree Visualization')
-                st.pyplot(fig4)
-
-    # Plot 5: Actual vs Predicted Scatter Plot
-                fig5, ax5 = plt.subplots()
-                ax5.scatter(y_test, y_pred, color='blue')
-                ax5.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'k--', lw=4)
-                ax5.set_xlabel('Actual')
-                ax5.set_ylabel('Predicted')
-                ax5.set_title('Actual vs Predicted')
-                st.pyplot(fig5)
-
-       
+                export_button(ScoringModel(model_name, dt_classifier, selected_features, target_column, preprocessor, use_sparse))
+
+    # Plots
+                show_plots(run_key, evaluation_plots(model_name, dt_classifier, X_train, y_train, X_test, y_test, y_pred, feature_names,
+                                                     curves=score_curves(run_key, dt_classifier, X_test, y_test)))
+
+            elif model_name == 'Gradient Boosting':
+                st.write('### Gradient Boosting Configuration')
+                st.write(f'Number of Estimators: {n_estimators_gb}')
+                st.write(f'Learning Rate: {learning_rate_gb}')
+
+    # Train the model (histogram-based: binned features, multithreaded)
+                gb_classifier, y_pred, cached = fit_predict(
+                    fit_key(params), HistGradientBoostingClassifier(max_iter=n_estimators_gb, learning_rate=learning_rate_gb, random_state=42),
+                    X_train, y_train, X_test, persist=persist_models)
+                if cached:
+                    st.write('Using the cached fitted model for this configuration')
+
+    # Evaluate the model
+                accuracy = accuracy_score(y_test, y_pred)
+                st.write('### Model Evaluation')
+                st.write(f'Accuracy: {accuracy:.2f}')
+
+                export_button(ScoringModel(model_name, gb_classifier, selected_features, target_column, preprocessor, use_sparse))
+
+    # Plots
+                show_plots(run_key, evaluation_plots(model_name, gb_classifier, X_train, y_train, X_test, y_test, y_pred, feature_names,
+                                                     curves=score_curves(run_key, gb_classifier, X_test, y_test)))
 
             elif model_name == 'Linear Regression':
                 st.write('### Linear Regression Configuration')
 
     # Train the model
-                lin_reg = LinearRegression()
-                lin_reg.fit(X_train, y_train)
+                lin_reg, y_pred, cached = fit_predict(
+                    fit_key({}), LinearRegression(),
+                    X_train, y_train, X_test, persist=persist_models)
+                if cached:
+                    st.write('Using the cached fitted model for this configuration')
 
     # Evaluate the model
             
-                y_pred = lin_reg.predict(X_test)
 
                 mse = mean_squared_error(y_test, y_pred)
                 mae = mean_absolute_error(y_test, y_pred)
@@ -488,52 +498,42 @@ def main():
                 st.write(f'Root Mean Squared Error: {rmse:.2f}')
                 st.write(f'R-squared: {r2:.2f}')  # Displaying R-squared score
 
-    # Plotting predicted vs actual values
-                fig, ax = plt.subplots()
-                ax.scatter(y_test, y_pred, color='blue')
-                ax.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'k--', lw=4)
-                ax.set_xlabel('Actual')
-                ax.set_ylabel('Predicted')
-                ax.set_title('Actual vs Predicted')
-                st.pyplot(fig)
-
-    # Additional plots
-                fig1, ax1 = plt.subplots()
-                ax1.hist(y_pred - y_test, bins=30, color='skyblue', edgecolor='black', alpha=0.7)
-                ax1.set_xlabel('Prediction Error')
-                ax1.set_ylabel('Frequency')
-                ax1.set_title('Error Histogram')
-                st.pyplot(fig1)
-
-                fig2, ax2 = plt.subplots()
-                ax2.boxplot(y_pred - y_test)
-                ax2.set_title('Boxplot of Prediction Error')
-
-                st.pyplot(fig2)
-
-                fig3, ax3 = plt.subplots()
-                ax3.plot(y_test, label='Actual', color='blue')
-                ax3.plot(y_pred, label='Predicted', color='red')
-                ax3.set_xlabel('Index')
-                ax3.set_ylabel('Value')
-                ax3.set_title('Actual vs Predicted')
-                ax3.legend()
-                st.pyplot(fig3)
-
-                fig4, ax4 = plt.subplots()
-                ax4.bar(['MSE', 'MAE', 'RMSE', 'R-squared'], [mse, mae, rmse, r2], color=['blue', 'green', 'orange', 'red'])
-                ax4.set_ylabel('Value')
-                ax4.set_title('Model Evaluation Metrics')
-                st.pyplot(fig4)
-
-                fig5, ax5 = plt.subplots()
-                ax5.plot(X_test[:100], y_test[:100], 'bo', label='Actual')  # Plotting a subset of data (first 100 points)
-                ax5.plot(X_test[:100], y_pred[:100], 'r-', label='Predicted')
-                ax5.set_xlabel('Feature')
-                ax5.set_ylabel('Target')
-                ax5.set_title('Actual vs Predicted')
-                ax5.legend()
-                st.pyplot(fig5)
+                export_button(ScoringModel(model_name, lin_reg, selected_features, target_column, preprocessor, use_sparse))
+
+    # Plots
+                show_plots(run_key, evaluation_plots(model_name, lin_reg, X_train, y_train, X_test, y_test, y_pred, feature_names,
+                                                     curves=score_curves(run_key, lin_reg, X_test, y_test)))
+
+        if incremental_mode:
+            # The model is fitted on the uploaded data once; each new file is scored and then trained on.
+            # With persistence every file's update is also saved, so applied files survive restarts
+            st.write('### Incremental Training')
+            incremental_sparse = sparse_training and model_name in SPARSE_MODELS
+            if model_name not in INCREMENTAL_MODELS:
+                st.write(f'{model_name} cannot be trained incrementally')
+            elif not selected_features:
+                st.write('Select the features to train on')
+            else:
+                session_key = model_key(data_key, selected_features, target_column, model_name, params, split_seed=42,
+                                        sparse=incremental_sparse, incremental=True)
+                try:
+                    session = get_session(session_key, model_name, params, persist=persist_models)
+                    if not session.fitted:
+                        base = project(data, selected_features + [target_column])
+                        X_base, _ = feature_matrix(base, selected_features, use_sparse=incremental_sparse)
+                        session.fit(X_base, dense_columns(base, [target_column])[target_column])
+                    if new_rows_file is not None:
+                        chunk_key, chunk, _ = load_dataset(new_rows_file)
+                        if preprocessor is not None:
+                            chunk = preprocessor.transform(chunk)
+                        X_new, _ = feature_matrix(chunk, selected_features, use_sparse=incremental_sparse)
+                        session.update(chunk_key, X_new, dense_columns(chunk, [target_column])[target_column])
+                except ValueError as e:
+                    st.write(f'Incremental training failed: {e}')
+                else:
+                    st.write(f'Trained on {session.rows:,} rows ({len(session.chunk_keys)} appended files). '
+                             'Each file is scored before the model is updated with it.')
+                    st.write(session.history())
 
 
 if __name__ == "__main__":
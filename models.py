@@ -0,0 +1,273 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.metrics import accuracy_score, mean_absolute_error, mean_squared_error, r2_score
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from ingest import CACHE_DIR, prune_disk_cache, touch
+from instrumentation import stage
+from neighbors import IVFKNeighborsClassifier
+from preprocessing import SPARSE_MODELS, to_dense
+from svm import ScalableSVC
+from trees import HistogramForestClassifier, HistogramTreeClassifier
+
+
+MODEL_CACHE_BYTES = int(os.environ.get('EVAL_MODEL_CACHE_BYTES', 512 * 2**20))
+MODEL_DIR = os.path.join(CACHE_DIR, 'models')
+MODEL_DISK_BYTES = int(os.environ.get('EVAL_MODEL_DISK_BYTES', 4 * 2**30))
+
+MODEL_NAMES = ['Random Forest', 'Logistic Regression', 'SVM', 'K-Nearest Neighbors', 'Decision Tree', 'Linear Regression',
+               'Gradient Boosting']
+REGRESSION_MODELS = {'Linear Regression'}
+
+# Same defaults as the sidebar widgets
+DEFAULT_PARAMS = {
+    'Random Forest': {'n_estimators': 10, 'max_depth': 10},
+    'Logistic Regression': {'C': 1.0},
+    'SVM': {'C': 1.0, 'kernel': 'linear', 'solver': 'auto'},
+    'K-Nearest Neighbors': {'n_neighbors': 5},
+    'Decision Tree': {'max_depth': 10},
+    'Linear Regression': {},
+    'Gradient Boosting': {'max_iter': 10, 'learning_rate': 0.1},
+}
+
+
+def build_estimator(model_name, params):
+    # max_bins selects the histogram (pre-binned) tree models
+    if model_name == 'Random Forest':
+        if 'max_bins' in params:
+            return HistogramForestClassifier(**params)
+        return RandomForestClassifier(random_state=42, n_jobs=-1, **params)
+    elif model_name == 'Logistic Regression':
+        return LogisticRegression(random_state=42, **params)
+    elif model_name == 'SVM':
+        return ScalableSVC(random_state=42, **params)
+    elif model_name == 'K-Nearest Neighbors':
+        # n_probe selects the approximate (IVF index) search
+        if 'n_probe' in params:
+            return IVFKNeighborsClassifier(**params)
+        return KNeighborsClassifier(**params)
+    elif model_name == 'Decision Tree':
+        if 'max_bins' in params:
+            return HistogramTreeClassifier(**params)
+        return DecisionTreeClassifier(random_state=42, **params)
+    elif model_name == 'Linear Regression':
+        return LinearRegression(**params)
+    elif model_name == 'Gradient Boosting':
+        return HistGradientBoostingClassifier(random_state=42, **params)
+    raise ValueError(f'Unknown model: {model_name}')
+
+
+def score(model_name, y_true, y_pred):
+    """Headline metric for a model: R-squared for regressors, accuracy for classifiers."""
+    if model_name in REGRESSION_MODELS:
+        return 'R-squared', r2_score(y_true, y_pred)
+    return 'Accuracy', accuracy_score(y_true, y_pred)
+
+
+def evaluation_metrics(model_name, y_true, y_pred):
+    if model_name in REGRESSION_MODELS:
+        mse = mean_squared_error(y_true, y_pred)
+        return {'MSE': mse, 'MAE': mean_absolute_error(y_true, y_pred), 'RMSE': np.sqrt(mse),
+                'R-squared': r2_score(y_true, y_pred)}
+    return {'Accuracy': accuracy_score(y_true, y_pred)}
+
+
+def model_key(data_key, features, target, model_name, params, split_seed=42, **options):
+    """Stable key for a fitted configuration: dataset, columns, model, hyperparameters and split."""
+    parts = (data_key, tuple(features), target, model_name, tuple(sorted(params.items())), split_seed,
+             tuple(sorted(options.items())))
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def estimator_bytes(obj, seen=None):
+    """Approximate memory held by an estimator: the arrays it references, found without copying them.
+
+    Walks attributes, containers and ``__getstate__`` (which exposes the node
+    arrays of sklearn's compiled trees), counting each object once.
+    """
+    # Keyed by id, holding the object so temporary states can't free their id for reuse
+    seen = {} if seen is None else seen
+    if id(obj) in seen or obj is None or isinstance(obj, (str, bytes, int, float, bool)):
+        return 0
+    seen[id(obj)] = obj
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes if obj.dtype != object else obj.nbytes + sum(estimator_bytes(item, seen) for item in obj.flat)
+    if sparse.issparse(obj):
+        return sum(getattr(obj, name).nbytes for name in ('data', 'indices', 'indptr', 'row', 'col', 'offsets')
+                   if hasattr(obj, name))
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(np.sum(obj.memory_usage(index=True)))
+    if isinstance(obj, dict):
+        return sum(estimator_bytes(value, seen) for value in obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(estimator_bytes(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        return estimator_bytes(vars(obj), seen)
+    try:
+        state = obj.__getstate__()
+    except (AttributeError, TypeError):
+        return 0
+    return estimator_bytes(state, seen) if state is not obj else 0
+
+
+def entry_size(estimator, y_pred):
+    return estimator_bytes(estimator) + getattr(y_pred, 'nbytes', 0)
+
+
+class ModelRegistry:
+    """Fitted estimators and their test-set predictions, evicted LRU once over ``max_bytes``.
+
+    With ``persist`` entries are also written to ``model_dir`` with joblib and
+    reloaded from there when they have been evicted from memory; the least
+    recently used files are removed beyond ``max_disk_bytes``.
+    """
+
+    def __init__(self, max_bytes=MODEL_CACHE_BYTES, model_dir=MODEL_DIR, max_disk_bytes=MODEL_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.model_dir = model_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _path(self, key):
+        return os.path.join(self.model_dir, f'{key}.joblib')
+
+    def get(self, key, persist=False):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if persist and os.path.exists(self._path(key)):
+            try:
+                entry = joblib.load(self._path(key))
+            except (OSError, EOFError, pickle.UnpicklingError):
+                return None
+            touch(self._path(key))
+            self._store(key, entry)
+            return entry
+        return None
+
+    def put(self, key, estimator, y_pred, persist=False):
+        entry = (estimator, y_pred)
+        self._store(key, entry)
+        if persist:
+            os.makedirs(self.model_dir, exist_ok=True)
+            tmp_path = f'{self._path(key)}.{os.getpid()}.tmp'
+            joblib.dump(entry, tmp_path)
+            os.replace(tmp_path, self._path(key))
+            prune_disk_cache(self.model_dir, self.max_disk_bytes, suffix='.joblib')
+        return entry
+
+    def _store(self, key, entry):
+        size = entry_size(*entry)
+        with self._lock:
+            self._entries[key] = entry
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            # Always keep the newest entry, even if it alone is over budget
+            while len(self._entries) > 1 and sum(self._sizes.values()) > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                del self._sizes[evicted]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+
+registry = ModelRegistry()
+
+
+def fit_predict(key, estimator, X_train, y_train, X_test, persist=False):
+    """Return ``(fitted_estimator, y_pred, cached)``, fitting only if ``key`` is unknown."""
+    entry = registry.get(key, persist=persist)
+    if entry is not None:
+        return entry[0], entry[1], True
+    with stage('fit', model=type(estimator).__name__):
+        estimator.fit(X_train, y_train)
+    with stage('predict', model=type(estimator).__name__):
+        y_pred = estimator.predict(X_test)
+    registry.put(key, estimator, y_pred, persist=persist)
+    return estimator, y_pred, False
+
+
+def _fit_timed(model_name, params, X_train, y_train, X_test):
+    # Runs in a worker process, so it must stay a module-level function
+    start = time.perf_counter()
+    estimator = build_estimator(model_name, params)
+    estimator.fit(X_train, y_train)
+    y_pred = estimator.predict(X_test)
+    return estimator, y_pred, time.perf_counter() - start
+
+
+def compare_models(configs, X_train, y_train, X_test, y_test, max_workers=None, persist=False):
+    """Fit several models concurrently in a process pool and yield leaderboard rows as they finish.
+
+    ``configs`` maps model name to ``(key, params)``. Configurations already in
+    the registry are yielded first without refitting. Models outside
+    ``SPARSE_MODELS`` are given a dense copy of sparse input.
+    """
+    pending = {}
+    for model_name, (key, params) in configs.items():
+        entry = registry.get(key, persist=persist)
+        if entry is not None:
+            yield _leaderboard_row(model_name, y_test, entry[1], fit_time=0.0, cached=True)
+        else:
+            pending[model_name] = (key, params)
+    if not pending:
+        return
+
+    # Densified once, and only if a model that needs it is fitted
+    dense = None
+    max_workers = max_workers or min(len(pending), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for model_name, (key, params) in pending.items():
+            X_fit, X_score = X_train, X_test
+            if model_name not in SPARSE_MODELS and sparse.issparse(X_train):
+                dense = dense or (to_dense(X_train), to_dense(X_test))
+                X_fit, X_score = dense
+            futures[pool.submit(_fit_timed, model_name, params, X_fit, y_train, X_score)] = model_name
+        for future in as_completed(futures):
+            model_name = futures[future]
+            try:
+                estimator, y_pred, fit_time = future.result()
+            except Exception as exc:  # noqa: BLE001 - one failing model shouldn't abort the comparison
+                yield {'Model': model_name, 'Metric': None, 'Score': np.nan, 'Fit Time (s)': np.nan,
+                       'Cached': False, 'Error': str(exc)}
+                continue
+            registry.put(pending[model_name][0], estimator, y_pred, persist=persist)
+            yield _leaderboard_row(model_name, y_test, y_pred, fit_time=fit_time, cached=False)
+
+
+def _leaderboard_row(model_name, y_test, y_pred, fit_time, cached):
+    try:
+        metric, value = score(model_name, y_test, y_pred)
+    except ValueError as exc:
+        return {'Model': model_name, 'Metric': None, 'Score': np.nan, 'Fit Time (s)': fit_time,
+                'Cached': cached, 'Error': str(exc)}
+    return {'Model': model_name, 'Metric': metric, 'Score': value, 'Fit Time (s)': fit_time,
+            'Cached': cached, 'Error': ''}
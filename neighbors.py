@@ -0,0 +1,194 @@
+import time
+
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.neighbors import KNeighborsClassifier
+
+from ingest import LRUCache
+from preprocessing import to_dense
+
+
+DEFAULT_PROBES = 8
+KMEANS_SAMPLE_PER_LIST = 64
+MAX_KMEANS_SAMPLE = 100000
+QUERY_CHUNK = 8192
+EXACT_SAMPLE = 1000
+MAX_CACHED_INDEXES = 2
+
+_indexes = LRUCache(MAX_CACHED_INDEXES)
+
+
+def _as_float32(X):
+    return np.ascontiguousarray(to_dense(X.to_numpy() if hasattr(X, 'to_numpy') else X), dtype=np.float32)
+
+
+class IVFIndex:
+    """Inverted-file index: training points bucketed by their nearest k-means centroid.
+
+    The points are stored reordered so each list is one contiguous slice,
+    ``points[offsets[l]:offsets[l + 1]]``, along with their squared norms.
+    """
+
+    def __init__(self, X, n_lists=None, random_state=42):
+        X = _as_float32(X)
+        n = len(X)
+        self.n_lists = n_lists or max(1, int(np.sqrt(n)))
+        self.n_lists = min(self.n_lists, n)
+        rng = np.random.default_rng(random_state)
+        sample_size = min(n, max(self.n_lists, min(MAX_KMEANS_SAMPLE, KMEANS_SAMPLE_PER_LIST * self.n_lists)))
+        sample = X[rng.choice(n, sample_size, replace=False)] if sample_size < n else X
+        kmeans = MiniBatchKMeans(n_clusters=self.n_lists, n_init=1, max_iter=20, batch_size=4096,
+                                 random_state=random_state).fit(sample)
+        self.centroids = kmeans.cluster_centers_.astype(np.float32)
+
+        assignment = np.concatenate([self._nearest_lists(X[start:start + QUERY_CHUNK], 1)[:, 0]
+                                     for start in range(0, n, QUERY_CHUNK)])
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.searchsorted(assignment[self.order], np.arange(self.n_lists + 1))
+        self.points = X[self.order]
+        self.norms = np.einsum('ij,ij->i', self.points, self.points)
+
+    def _nearest_lists(self, Q, n_probe):
+        d = (Q ** 2).sum(axis=1)[:, None] - 2 * Q @ self.centroids.T + (self.centroids ** 2).sum(axis=1)
+        n_probe = min(n_probe, self.n_lists)
+        if n_probe == self.n_lists:
+            return np.broadcast_to(np.arange(self.n_lists), d.shape)
+        return np.argpartition(d, n_probe - 1, axis=1)[:, :n_probe]
+
+    def search(self, Q, k, n_probe=DEFAULT_PROBES):
+        """Approximate ``k`` nearest training points for each query: ``(distances, indices)``.
+
+        Only the ``n_probe`` lists closest to a query are scanned. The queries
+        are processed list by list, so each list is compared against all the
+        queries probing it in one matrix product. Missing neighbours (fewer
+        than ``k`` candidates) have index -1 and an infinite distance.
+        """
+        Q = _as_float32(Q)
+        distances = np.full((len(Q), k), np.inf, dtype=np.float32)
+        indices = np.full((len(Q), k), -1, dtype=np.int64)
+        for start in range(0, len(Q), QUERY_CHUNK):
+            chunk = slice(start, start + QUERY_CHUNK)
+            distances[chunk], indices[chunk] = self._search_chunk(Q[chunk], k, n_probe)
+        return distances, indices
+
+    def _search_chunk(self, Q, k, n_probe):
+        probes = self._nearest_lists(Q, n_probe)
+        q_norms = np.einsum('ij,ij->i', Q, Q)
+        best_d = np.full((len(Q), k), np.inf, dtype=np.float32)
+        best_i = np.full((len(Q), k), -1, dtype=np.int64)
+        # Queries grouped by the lists they probe
+        rows = np.repeat(np.arange(len(Q)), probes.shape[1])
+        lists = probes.ravel()
+        by_list = np.argsort(lists, kind='stable')
+        list_bounds = np.searchsorted(lists[by_list], np.arange(self.n_lists + 1))
+        for list_id in range(self.n_lists):
+            lo, hi = self.offsets[list_id], self.offsets[list_id + 1]
+            queries = rows[by_list[list_bounds[list_id]:list_bounds[list_id + 1]]]
+            if lo == hi or not len(queries):
+                continue
+            d = q_norms[queries, None] - 2 * Q[queries] @ self.points[lo:hi].T + self.norms[lo:hi]
+            candidates_d = np.concatenate([best_d[queries], d], axis=1)
+            candidates_i = np.concatenate([best_i[queries], np.broadcast_to(np.arange(lo, hi), d.shape)], axis=1)
+            if candidates_d.shape[1] > k:
+                keep = np.argpartition(candidates_d, k - 1, axis=1)[:, :k]
+                candidates_d = np.take_along_axis(candidates_d, keep, axis=1)
+                candidates_i = np.take_along_axis(candidates_i, keep, axis=1)
+            best_d[queries], best_i[queries] = candidates_d, candidates_i
+        # Back to the caller's training-row numbering, nearest first
+        order = np.argsort(best_d, axis=1)
+        best_d = np.take_along_axis(best_d, order, axis=1)
+        best_i = np.take_along_axis(best_i, order, axis=1)
+        return np.sqrt(np.maximum(best_d, 0)), np.where(best_i >= 0, self.order[np.maximum(best_i, 0)], -1)
+
+
+def get_index(index_key, X, n_lists=None, random_state=42):
+    """The IVF index for a training set, built once per ``index_key`` (``None`` skips the cache)."""
+    if index_key is None:
+        return IVFIndex(X, n_lists=n_lists, random_state=random_state)
+    key = (index_key, n_lists, random_state)
+    index = _indexes.get(key)
+    if index is None:
+        index = IVFIndex(X, n_lists=n_lists, random_state=random_state)
+        _indexes.put(key, index)
+    return index
+
+
+class IVFKNeighborsClassifier(ClassifierMixin, BaseEstimator):
+    """k-nearest-neighbours classifier over an approximate IVF index.
+
+    ``n_probe`` is the recall/speed knob: more probed lists find more of the
+    true neighbours at a higher cost, and probing all ``n_lists`` lists is an
+    exact search. Votes are uniform over Euclidean neighbours, as in
+    ``KNeighborsClassifier``'s defaults. Sparse input is densified.
+    """
+
+    def __init__(self, n_neighbors=5, n_probe=DEFAULT_PROBES, n_lists=None, index_key=None, random_state=42):
+        self.n_neighbors = n_neighbors
+        self.n_probe = n_probe
+        self.n_lists = n_lists
+        self.index_key = index_key
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        y = np.asarray(y)
+        self.classes_, self._y = np.unique(y, return_inverse=True)
+        self.index_ = get_index(self.index_key, X, n_lists=self.n_lists, random_state=self.random_state)
+        self.n_features_in_ = self.index_.points.shape[1]
+        return self
+
+    def kneighbors(self, X, n_neighbors=None):
+        return self.index_.search(X, n_neighbors or self.n_neighbors, n_probe=self.n_probe)
+
+    def _votes(self, X):
+        _, indices = self.kneighbors(X)
+        found = indices >= 0
+        votes = np.zeros((len(indices), len(self.classes_)))
+        rows = np.broadcast_to(np.arange(len(indices))[:, None], indices.shape)
+        np.add.at(votes, (rows[found], self._y[indices[found]]), 1)
+        return votes
+
+    def predict(self, X):
+        return self.classes_[self._votes(X).argmax(axis=1)]
+
+    def predict_proba(self, X):
+        votes = self._votes(X)
+        return votes / np.maximum(votes.sum(axis=1, keepdims=True), 1)
+
+
+def compare_to_exact(estimator, X_train, y_train, X_test, y_test, sample=EXACT_SAMPLE, random_state=42):
+    """Measure what the approximate search costs on a sample of test rows.
+
+    Runs an exact ``KNeighborsClassifier`` on up to ``sample`` test rows and
+    reports both accuracies, how often the predictions agree, the recall of
+    the true neighbours, and the time each search took on the sample.
+    """
+    rng = np.random.default_rng(random_state)
+    rows = np.sort(rng.choice(X_test.shape[0], min(sample, X_test.shape[0]), replace=False))
+    X_sample = _as_float32(X_test[rows] if not hasattr(X_test, 'iloc') else X_test.iloc[rows])
+    y_sample = np.asarray(y_test)[rows]
+    k = estimator.n_neighbors
+
+    exact = KNeighborsClassifier(n_neighbors=k).fit(_as_float32(X_train), np.asarray(y_train))
+    start = time.perf_counter()
+    exact_pred = exact.predict(X_sample)
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    approx_pred = estimator.predict(X_sample)
+    approx_time = time.perf_counter() - start
+
+    _, exact_indices = exact.kneighbors(X_sample)
+    _, approx_indices = estimator.kneighbors(X_sample)
+    recall = float(np.mean([len(np.intersect1d(a, e)) / k for a, e in zip(approx_indices, exact_indices)]))
+    exact_accuracy = float(np.mean(exact_pred == y_sample))
+    approx_accuracy = float(np.mean(approx_pred == y_sample))
+    return {
+        'Rows Compared': len(rows),
+        'Exact Accuracy': exact_accuracy,
+        'Approximate Accuracy': approx_accuracy,
+        'Accuracy Loss': exact_accuracy - approx_accuracy,
+        'Prediction Agreement': float(np.mean(exact_pred == approx_pred)),
+        f'Neighbor Recall@{k}': recall,
+        'Exact Time (s)': exact_time,
+        'Approximate Time (s)': approx_time,
+    }
@@ -0,0 +1,325 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from sklearn.metrics import confusion_matrix
+from sklearn.tree import plot_tree
+
+from analysis import histogram
+from curves import ScoreCurves
+from ingest import LRUCache
+from instrumentation import current, traced
+from models import evaluation_metrics
+from preprocessing import to_dense
+
+
+MAX_CACHED_FIGURES = 64
+RENDER_THREADS = min(4, os.cpu_count() or 1)
+MAX_LEGEND_CLASSES = 10
+KDE_SAMPLE = 5000
+# Deeper trees are unreadable at any figure size and take long to lay out
+PLOT_TREE_DEPTH = 4
+
+# Figures are built with the object-oriented API (no pyplot state), so several
+# can be drawn at once from worker threads
+_executor = ThreadPoolExecutor(max_workers=RENDER_THREADS, thread_name_prefix='render')
+_figures = LRUCache(MAX_CACHED_FIGURES)
+
+
+def render(draw, *args, fmt='png', figsize=None):
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    draw(ax, *args)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def submit_plot(model_key, plot_type, draw, *args, fmt='png', figsize=None):
+    """Render a plot in the background thread pool and return a future of its image bytes.
+
+    Futures are cached per ``(model_key, plot_type, fmt)``, so asking for the
+    same plot again, on this rerun or a later one, doesn't redraw it.
+    """
+    key = (model_key, plot_type, fmt)
+    future = _figures.get(key)
+    if future is None or (future.done() and future.exception() is not None):
+        # Recorded into the submitting run's recorder, on the worker thread that draws it
+        future = _executor.submit(traced, current(), f'plot: {plot_type}', render, draw, *args, fmt=fmt, figsize=figsize)
+        _figures.put(key, future)
+    return future
+
+
+def plot_confusion_matrix(ax, y_test, y_pred):
+    cm = confusion_matrix(y_test, y_pred)
+    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', cbar=False, ax=ax)
+    ax.set_xlabel('Predicted')
+    ax.set_ylabel('Actual')
+    ax.set_title('Confusion Matrix')
+
+
+def _curve_label(curves, label):
+    # A single binary curve needs no legend entry beyond its score
+    return '' if len(curves.curves) == 1 else f'{label} vs rest, '
+
+
+def _legend(ax, curves):
+    if len(curves.curves) <= MAX_LEGEND_CLASSES:
+        ax.legend(fontsize='small')
+
+
+def _binned_suffix(curves):
+    return f' ({curves.bins} score bins)' if curves.binned else ''
+
+
+def plot_roc_curve(ax, curves):
+    for label, curve in curves.curves.items():
+        ax.plot(curve['fpr'], curve['tpr'], lw=2, label=f"{_curve_label(curves, label)}AUC {curve['roc_auc']:.3f}")
+    ax.plot([0, 1], [0, 1], color='red', lw=2, linestyle='--')
+    ax.set_xlabel('False Positive Rate')
+    ax.set_ylabel('True Positive Rate')
+    ax.set_title('ROC Curve' + _binned_suffix(curves))
+    _legend(ax, curves)
+
+
+def plot_precision_recall(ax, curves):
+    for label, curve in curves.curves.items():
+        ax.plot(curve['recall'], curve['precision'], lw=2,
+                label=f"{_curve_label(curves, label)}AP {curve['average_precision']:.3f}")
+    ax.set_xlabel('Recall')
+    ax.set_ylabel('Precision')
+    ax.set_title('Precision-Recall Curve' + _binned_suffix(curves))
+    _legend(ax, curves)
+
+
+def plot_calibration(ax, curves):
+    for label, curve in curves.curves.items():
+        predicted, observed, _ = curve['calibration']
+        ax.plot(predicted, observed, marker='o', label=_curve_label(curves, label).rstrip(', ') or 'Model')
+    ax.plot([0, 1], [0, 1], color='gray', linestyle='--', label='Perfectly calibrated')
+    ax.set_xlabel('Mean Predicted Probability')
+    ax.set_ylabel('Fraction of Positives')
+    ax.set_title('Calibration Curve')
+    _legend(ax, curves)
+
+
+def plot_threshold_sweep(ax, curves):
+    if len(curves.curves) == 1:
+        (curve,) = curves.curves.values()
+        ax.plot(curve['thresholds'], curve['precision'][1:], label='Precision')
+        ax.plot(curve['thresholds'], curve['recall'][1:], label='Recall')
+        ax.plot(curve['thresholds'], curve['f1'], label='F1')
+    else:
+        for label, curve in curves.curves.items():
+            ax.plot(curve['thresholds'], curve['f1'], label=f'{label} vs rest')
+    ax.set_xlabel('Probability Threshold' if curves.is_probability else 'Decision Threshold')
+    ax.set_ylabel('Precision / Recall / F1' if len(curves.curves) == 1 else 'F1')
+    ax.set_title('Threshold Sweep' + _binned_suffix(curves))
+    _legend(ax, curves)
+
+
+def plot_class_distributions(ax, curves, sample=KDE_SAMPLE, random_state=42):
+    # Binary: the positive-class score split by the actual class. Multiclass: each
+    # class's score on the rows that really are that class. The KDE uses a sample per group.
+    rng = np.random.default_rng(random_state)
+    scores, classes, y_test = curves.scores, curves.classes, curves.y_test
+    if len(classes) == 2:
+        groups = [(f'Class {label}', scores[y_test == label, 1]) for label in classes]
+    else:
+        groups = [(f'Class {label}', scores[y_test == label, i]) for i, label in enumerate(classes)]
+    for name, values in groups:
+        if len(values) > sample:
+            values = rng.choice(values, sample, replace=False)
+        if len(values) > 1 and np.ptp(values) > 0:
+            sns.kdeplot(values, label=name, fill=True, ax=ax, warn_singular=False)
+    ax.set_xlabel('Predicted Probability' if curves.is_probability else 'Decision Score')
+    ax.set_ylabel('Density')
+    ax.set_title('Score Distributions by Actual Class')
+    _legend(ax, curves)
+
+
+def plot_actual_vs_predicted(ax, y_test, y_pred):
+    ax.scatter(y_test, y_pred, color='blue')
+    ax.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'k--', lw=4)
+    ax.set_xlabel('Actual')
+    ax.set_ylabel('Predicted')
+    ax.set_title('Actual vs Predicted')
+
+
+def plot_feature_bars(ax, values, feature_names, xlabel, title):
+    ax.figure.set_size_inches(10, 6)
+    sns.barplot(x=values, y=list(feature_names), ax=ax)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Features')
+    ax.set_title(title)
+
+
+def plot_decision_tree(ax, estimator, feature_names, max_depth=PLOT_TREE_DEPTH):
+    # Histogram trees split on bin numbers; their display copy has the thresholds in feature units
+    tree = estimator.display_tree() if hasattr(estimator, 'display_tree') else estimator
+    plot_tree(tree, feature_names=list(feature_names), filled=True, max_depth=max_depth, ax=ax)
+    depth = tree.get_depth()
+    ax.set_title('Decision Tree Visualization' + (f' (top {max_depth} of {depth} levels)' if depth > max_depth else ''))
+
+
+def plot_decision_boundaries(ax, estimator, X, y, resolution=200):
+    # Only meaningful with exactly two features
+    columns = X.columns if isinstance(X, pd.DataFrame) else None
+    X = np.asarray(to_dense(X.to_numpy() if columns is not None else X), dtype=float)
+    y = np.asarray(y)
+    xx, yy = np.meshgrid(np.linspace(X[:, 0].min(), X[:, 0].max(), resolution),
+                         np.linspace(X[:, 1].min(), X[:, 1].max(), resolution))
+    grid = np.c_[xx.ravel(), yy.ravel()]
+    if columns is not None:
+        grid = pd.DataFrame(grid, columns=columns)
+    zz = estimator.predict(grid).reshape(xx.shape)
+    labels, zz = np.unique(zz, return_inverse=True)
+    ax.contourf(xx, yy, zz.reshape(xx.shape), alpha=0.3, cmap='coolwarm')
+    ax.scatter(X[:, 0], X[:, 1], c=np.searchsorted(labels, y), cmap='coolwarm', s=10, edgecolor='k')
+    ax.set_title('Decision Boundaries')
+
+
+def plot_error_histogram(ax, y_test, y_pred):
+    ax.hist(y_pred - y_test, bins=30, color='skyblue', edgecolor='black', alpha=0.7)
+    ax.set_xlabel('Prediction Error')
+    ax.set_ylabel('Frequency')
+    ax.set_title('Error Histogram')
+
+
+def plot_error_boxplot(ax, y_test, y_pred):
+    ax.boxplot(y_pred - y_test)
+    ax.set_title('Boxplot of Prediction Error')
+
+
+def plot_actual_and_predicted(ax, y_test, y_pred):
+    ax.plot(y_test, label='Actual', color='blue')
+    ax.plot(y_pred, label='Predicted', color='red')
+    ax.set_xlabel('Index')
+    ax.set_ylabel('Value')
+    ax.set_title('Actual vs Predicted')
+    ax.legend()
+
+
+def plot_metrics_bar(ax, metrics):
+    ax.bar(list(metrics), list(metrics.values()), color=['blue', 'green', 'orange', 'red'])
+    ax.set_ylabel('Value')
+    ax.set_title('Model Evaluation Metrics')
+
+
+def plot_feature_vs_target(ax, X_test, y_test, y_pred):
+    # Plotting a subset of data (first 100 points)
+    ax.plot(to_dense(X_test[:100]), y_test[:100], 'bo', label='Actual')
+    ax.plot(to_dense(X_test[:100]), y_pred[:100], 'r-', label='Predicted')
+    ax.set_xlabel('Feature')
+    ax.set_ylabel('Target')
+    ax.set_title('Actual vs Predicted')
+    ax.legend()
+
+
+def plot_binned_histogram(ax, feature, counts, edges, kde_x=None, kde_y=None):
+    ax.figure.set_size_inches(8, 5)
+    ax.stairs(counts, edges, fill=True, alpha=0.6)
+    if kde_x is not None:
+        ax.plot(kde_x, kde_y)
+    ax.set_xlabel(feature)
+    ax.set_ylabel("Frequency")
+
+
+def plot_column_histogram(ax, feature, series, sample=None):
+    # Binned and KDE-fitted on the render thread, only when the figure isn't cached yet
+    plot_binned_histogram(ax, feature, *histogram(series, sample=sample))
+
+
+def plot_quantile_boxplot(ax, stats):
+    ax.figure.set_size_inches(10, 6)
+    ax.bxp(stats, showfliers=False)
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+def plot_correlation(ax, corr):
+    ax.figure.set_size_inches(10, 8)
+    sns.heatmap(corr, annot=True, cmap='coolwarm', ax=ax)
+
+
+def plot_pairs(ax, sample):
+    # Scatter matrix with histograms on the diagonal, drawn on the render figure
+    # (sns.pairplot makes its own pyplot figure, which isn't safe off the main thread)
+    fig = ax.figure
+    fig.delaxes(ax)
+    columns = list(sample.columns)
+    fig.set_size_inches(2.5 * len(columns), 2.5 * len(columns))
+    axes = np.atleast_2d(fig.subplots(len(columns), len(columns), squeeze=False))
+    for i, y_column in enumerate(columns):
+        for j, x_column in enumerate(columns):
+            cell = axes[i, j]
+            if i == j:
+                cell.hist(sample[x_column].dropna(), bins=20)
+            else:
+                cell.scatter(sample[x_column], sample[y_column], s=4, alpha=0.5)
+            if i == len(columns) - 1:
+                cell.set_xlabel(x_column)
+            if j == 0:
+                cell.set_ylabel(y_column)
+
+
+def plot_value_counts(ax, counts):
+    ax.figure.set_size_inches(8, 5)
+    ax.bar([str(label) for label in counts.index], counts.to_numpy())
+    ax.set_xlabel(counts.index.name)
+    ax.set_ylabel("count")
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+def evaluation_plots(model_name, estimator, X_train, y_train, X_test, y_test, y_pred, feature_names, curves=None):
+    """The evaluation plots shown for each model, as ``{title: (draw, *args)}``.
+
+    The score-based curves share ``curves`` (a ``ScoreCurves`` for the test
+    set, created here if not given), so the class scores are computed once.
+    """
+    if model_name == 'Linear Regression':
+        return {
+            'Actual vs Predicted': (plot_actual_vs_predicted, y_test, y_pred),
+            'Error Histogram': (plot_error_histogram, y_test, y_pred),
+            'Error Boxplot': (plot_error_boxplot, y_test, y_pred),
+            'Actual vs Predicted by Index': (plot_actual_and_predicted, y_test, y_pred),
+            'Evaluation Metrics': (plot_metrics_bar, evaluation_metrics(model_name, y_test, y_pred)),
+            'Feature vs Target': (plot_feature_vs_target, X_test, y_test, y_pred),
+        }
+
+    plots = {}
+    if model_name == 'Logistic Regression':
+        plots['Feature Coefficients'] = (plot_feature_bars, estimator.coef_[0], feature_names, 'Coefficient Value',
+                                         'Feature Coefficients')
+    elif model_name == 'SVM':
+        # Only linear kernels have coefficients, and only they line up with the features
+        coefficients = np.abs(to_dense(estimator.coef_).flatten()) if hasattr(estimator, 'coef_') else []
+        if len(coefficients) == len(feature_names):
+            plots['Feature Coefficients'] = (plot_feature_bars, coefficients, feature_names,
+                                             'Absolute Coefficient Value', 'Feature Coefficients (Absolute Values)')
+    elif model_name in ('Decision Tree', 'Random Forest'):
+        plots['Feature Importances'] = (plot_feature_bars, estimator.feature_importances_, feature_names,
+                                        'Feature Importance', 'Feature Importances')
+
+    if curves is None:
+        curves = ScoreCurves(estimator, X_test, y_test)
+    plots['Confusion Matrix'] = (plot_confusion_matrix, y_test, y_pred)
+    plots['ROC Curve'] = (plot_roc_curve, curves)
+    plots['Precision-Recall Curve'] = (plot_precision_recall, curves)
+    plots['Threshold Sweep'] = (plot_threshold_sweep, curves)
+    if hasattr(estimator, 'predict_proba'):
+        plots['Calibration Curve'] = (plot_calibration, curves)
+    plots['Probability Distributions'] = (plot_class_distributions, curves)
+    if model_name == 'Decision Tree':
+        plots['Decision Tree'] = (plot_decision_tree, estimator, feature_names)
+    if model_name != 'Random Forest':
+        plots['Actual vs Predicted'] = (plot_actual_vs_predicted, y_test, y_pred)
+    if model_name in ('Random Forest', 'K-Nearest Neighbors') and X_train.shape[1] == 2:
+        # Only plot if there are 2 features
+        plots['Decision Boundaries'] = (plot_decision_boundaries, estimator, X_train, y_train)
+    return plots
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import OneHotEncoder
+
+from ingest import LRUCache
+from instrumentation import stage
+
+
+MAX_ONEHOT_CATEGORIES = 50
+HASH_ABOVE_CARDINALITY = 1000
+HASH_FEATURES = 64
+MAX_CACHED_PIPELINES = 4
+
+_pipelines = LRUCache(MAX_CACHED_PIPELINES)
+
+
+def is_categorical(series):
+    return (pd.api.types.is_object_dtype(series.dtype)
+            or pd.api.types.is_string_dtype(series.dtype)
+            or isinstance(series.dtype, pd.CategoricalDtype))
+
+
+def hash_encode(series, n_features):
+    # Vectorised hashing trick: one non-zero per row at hash(value) % n_features
+    values = series.astype(object).where(series.notna(), '')
+    columns = (pd.util.hash_pandas_object(values, index=False).to_numpy() % n_features).astype(np.int32)
+    rows = np.arange(len(series), dtype=np.int32)
+    data = np.ones(len(series), dtype=np.uint8)
+    return sparse.csr_matrix((data, (rows, columns)), shape=(len(series), n_features))
+
+
+class Preprocessor:
+    """Back-fill nulls and one-hot encode text columns into sparse columns.
+
+    Replaces ``df.fillna(method='bfill')`` followed by ``pd.get_dummies(df)``.
+    Columns with up to ``max_categories`` distinct values are one-hot encoded as
+    before; rarer values beyond that are grouped into a single
+    ``<column>_infrequent_sklearn`` column, and columns with more than
+    ``hash_above`` distinct values are hashed into ``hash_features`` buckets.
+    Once fitted, ``transform`` applies exactly the same columns to new data.
+    """
+
+    def __init__(self, max_categories=MAX_ONEHOT_CATEGORIES, hash_above=HASH_ABOVE_CARDINALITY,
+                 hash_features=HASH_FEATURES):
+        self.max_categories = max_categories
+        self.hash_above = hash_above
+        self.hash_features = hash_features
+
+    def fit(self, df):
+        self._fit_filled(df.bfill())
+        return self
+
+    def _fit_filled(self, df):
+        self.filled_preview_ = df.head()
+        self.columns_ = list(df.columns)
+        self.numeric_columns_ = [column for column in df.columns if not is_categorical(df[column])]
+        categorical = [column for column in df.columns if is_categorical(df[column])]
+        self.hashed_columns_ = [column for column in categorical if df[column].nunique() > self.hash_above]
+        self.onehot_columns_ = [column for column in categorical if column not in self.hashed_columns_]
+
+        self.encoder_ = None
+        if self.onehot_columns_:
+            self.encoder_ = OneHotEncoder(max_categories=self.max_categories, handle_unknown='infrequent_if_exist',
+                                          sparse_output=True, dtype=np.uint8)
+            self.encoder_.fit(df[self.onehot_columns_].astype(object))
+
+        # Encoded column names per input column, in output order
+        self.encoded_columns_ = {column: [column] for column in self.numeric_columns_}
+        if self.encoder_ is not None:
+            names = iter(self.encoder_.get_feature_names_out(self.onehot_columns_))
+            for column, categories, infrequent in zip(self.onehot_columns_, self.encoder_.categories_,
+                                                      self.encoder_.infrequent_categories_):
+                # Infrequent categories share a single output column
+                n_outputs = len(categories) - (len(infrequent) - 1 if infrequent is not None else 0)
+                self.encoded_columns_[column] = [next(names) for _ in range(n_outputs)]
+        for column in self.hashed_columns_:
+            self.encoded_columns_[column] = [f'{column}_hash{i}' for i in range(self.hash_features)]
+        self.feature_names_ = [name for column in self.numeric_columns_ + self.onehot_columns_ + self.hashed_columns_
+                               for name in self.encoded_columns_[column]]
+
+    def _encoded_blocks(self, df):
+        blocks = []
+        if self.encoder_ is not None:
+            blocks.append(self.encoder_.transform(df[self.onehot_columns_].astype(object)))
+        for column in self.hashed_columns_:
+            blocks.append(hash_encode(df[column], self.hash_features))
+        return blocks
+
+    def transform(self, df, groups=None):
+        """Return the encoded frame: numeric columns stay dense, encoded columns are sparse.
+
+        Columns missing from ``df`` (e.g. the target, when scoring new rows)
+        come through as nulls. With ``groups`` nulls are only back-filled from
+        later rows of the same group.
+        """
+        df = df.reindex(columns=self.columns_)
+        return self._transform_filled(df.bfill() if groups is None else df.groupby(groups, sort=False).bfill())
+
+    def _transform_filled(self, df):
+        blocks = self._encoded_blocks(df)
+        encoded_names = self.feature_names_[len(self.numeric_columns_):]
+        encoded = (pd.DataFrame.sparse.from_spmatrix(sparse.hstack(blocks, format='csc'), index=df.index,
+                                                     columns=encoded_names)
+                   if blocks else None)
+        return pd.concat([df[self.numeric_columns_], encoded], axis=1) if encoded is not None else df[self.numeric_columns_]
+
+    def fit_transform(self, df):
+        with stage('bfill'):
+            df = df.bfill()
+        with stage('encode'):
+            self._fit_filled(df)
+            return self._transform_filled(df)
+
+
+def dense_columns(df, columns):
+    # Sparse one-hot columns are fine for the models but not for seaborn
+    subset = df[list(columns)]
+    converted = {column: subset[column].sparse.to_dense() if isinstance(subset[column].dtype, pd.SparseDtype)
+                 else subset[column] for column in subset.columns}
+    return pd.DataFrame(converted, index=subset.index)
+
+
+def preprocess(data_key, df, **options):
+    """Fit (or fetch from cache) the preprocessor for this dataset and options."""
+    key = (data_key, tuple(sorted(options.items())))
+    entry = _pipelines.get(key)
+    if entry is None:
+        preprocessor = Preprocessor(**options)
+        entry = (preprocessor, preprocessor.fit_transform(df))
+        _pipelines.put(key, entry)
+    preprocessor, encoded = entry
+    return preprocessor, encoded.copy(deep=False)
+
+
+# Models whose estimators accept scipy sparse input in fit/predict
+SPARSE_MODELS = {'Random Forest', 'Logistic Regression', 'SVM', 'K-Nearest Neighbors', 'Decision Tree',
+                 'Linear Regression'}
+
+
+def has_sparse_columns(df, columns):
+    return any(isinstance(df[column].dtype, pd.SparseDtype) for column in columns)
+
+
+def feature_matrix(df, columns, use_sparse=True):
+    """Return ``(X, feature_names)`` for the selected columns.
+
+    With ``use_sparse`` and at least one sparse (encoded) column, ``X`` is a CSR
+    matrix built straight from the sparse columns without densifying them; the
+    dense columns come first, so ``feature_names`` follows that order.
+    Otherwise ``X`` is a dense frame in the selected order.
+    """
+    columns = list(columns)
+    if not use_sparse or not has_sparse_columns(df, columns):
+        return dense_columns(df, columns), columns
+
+    sparse_cols = [column for column in columns if isinstance(df[column].dtype, pd.SparseDtype)]
+    dense_cols = [column for column in columns if column not in sparse_cols]
+    blocks = []
+    if dense_cols:
+        blocks.append(sparse.csr_matrix(df[dense_cols].to_numpy(dtype=np.float64)))
+    blocks.append(df[sparse_cols].sparse.to_coo().astype(np.float64))
+    return sparse.hstack(blocks, format='csr'), dense_cols + sparse_cols
+
+
+def to_dense(X):
+    return X.toarray() if sparse.issparse(X) else X
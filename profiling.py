@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+from ingest import LRUCache, project
+from preprocessing import dense_columns
+
+
+CHUNK_ROWS = 100000
+SKETCH_SIZE = 10000
+MAX_DISTINCT = 1000000
+MAX_VALUE_COUNTS = 1000
+MAX_CACHED_PROFILERS = 4
+
+_profilers = LRUCache(MAX_CACHED_PROFILERS)
+
+
+def is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+
+class ColumnStats:
+    """Running statistics for one column, updated chunk by chunk."""
+
+    def __init__(self, name, numeric, rng):
+        self.name = name
+        self.numeric = numeric
+        self.rng = rng
+        self.count = 0
+        self.nulls = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.distinct = np.empty(0, dtype=np.uint64)
+        self.distinct_capped = False
+        self.value_counts = None if numeric else pd.Series(dtype='int64')
+        # Quantile sketch: uniform bottom-k sample on random keys, mergeable across chunks
+        self.sketch = np.empty(0)
+        self.sketch_keys = np.empty(0)
+
+    def update(self, series):
+        self.nulls += int(series.isna().sum())
+        present = series.dropna()
+        self._update_distinct(present)
+        if self.numeric:
+            self._update_moments(present.to_numpy(dtype=float))
+        elif self.value_counts is not None:
+            self.value_counts = self.value_counts.add(present.value_counts(), fill_value=0).astype('int64')
+            if len(self.value_counts) > MAX_VALUE_COUNTS:
+                self.value_counts = None
+        if not self.numeric:
+            self.count += len(present)
+
+    def _update_distinct(self, present):
+        if self.distinct_capped:
+            return
+        hashes = pd.util.hash_pandas_object(present, index=False).to_numpy()
+        self.distinct = np.union1d(self.distinct, hashes)
+        if len(self.distinct) > MAX_DISTINCT:
+            self.distinct_capped = True
+            self.distinct = np.empty(0, dtype=np.uint64)
+
+    def _update_moments(self, values):
+        if not len(values):
+            return
+        # Chan et al. parallel update of count / mean / sum of squared deviations
+        count = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        delta = mean - self.mean
+        total = self.count + count
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        keys = self.rng.random(count)
+        self.sketch = np.concatenate([self.sketch, values])
+        self.sketch_keys = np.concatenate([self.sketch_keys, keys])
+        if len(self.sketch) > SKETCH_SIZE:
+            keep = np.argpartition(self.sketch_keys, SKETCH_SIZE)[:SKETCH_SIZE]
+            self.sketch = self.sketch[keep]
+            self.sketch_keys = self.sketch_keys[keep]
+
+    def quantiles(self, qs):
+        if not len(self.sketch):
+            return [np.nan] * len(qs)
+        # The sketch is approximate; the exact extremes are tracked separately
+        values = np.quantile(self.sketch, qs)
+        return [self.min if q == 0 else self.max if q == 1 else value for q, value in zip(qs, values)]
+
+    def summary(self):
+        # Cardinality stops being tracked (and reads as MAX_DISTINCT) past MAX_DISTINCT values
+        row = {'count': self.count, 'nulls': self.nulls,
+               'cardinality': MAX_DISTINCT if self.distinct_capped else len(self.distinct)}
+        if self.numeric and self.count:
+            q1, median, q3 = self.quantiles([0.25, 0.5, 0.75])
+            row.update({'mean': self.mean, 'std': np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan,
+                        'min': self.min, '25%': q1, '50%': median, '75%': q3, 'max': self.max})
+        return row
+
+
+class Profiler:
+    """Column profiles and a pairwise correlation matrix built up incrementally.
+
+    Each call only scans the columns it hasn't seen yet, in chunks of
+    ``chunk_rows`` rows, and computes their moments, quantile sketch, null
+    count, cardinality and value counts in the same pass. Correlations are
+    kept as running pairwise-complete cross-product sums, so adding a column
+    only fills in its row and column of the matrix.
+    """
+
+    def __init__(self, source, chunk_rows=CHUNK_ROWS, random_state=42):
+        # A frame or a ColumnStore; only the profiled columns are read from it
+        self.source = source
+        self.chunk_rows = chunk_rows
+        self.rng = np.random.default_rng(random_state)
+        self.stats = {}
+        self.corr_columns = []
+        self._shift = np.empty(0)
+        self._n = np.empty((0, 0))
+        self._sum = np.empty((0, 0))   # [i, j]: sum of shifted x_i where x_i and x_j are present
+        self._sum_sq = np.empty((0, 0))
+        self._cross = np.empty((0, 0))
+
+    def _chunks(self, columns):
+        df = project(self.source, columns)
+        for start in range(0, len(df), self.chunk_rows):
+            yield dense_columns(df.iloc[start:start + self.chunk_rows], columns)
+
+    def profile(self, columns):
+        columns = list(columns)
+        new = [column for column in columns if column not in self.stats]
+        if new:
+            df = project(self.source, new)
+            stats = {column: ColumnStats(column, is_numeric(df[column]), self.rng) for column in new}
+            for chunk in self._chunks(new):
+                for column in new:
+                    stats[column].update(chunk[column])
+            self.stats.update(stats)
+        return pd.DataFrame([self.stats[column].summary() for column in columns], index=columns)
+
+    def correlation(self, columns):
+        columns = list(columns)
+        self.profile(columns)
+        new = [column for column in columns if column not in self.corr_columns]
+        if new:
+            self._add_correlation_columns(new)
+        index = [self.corr_columns.index(column) for column in columns]
+        block = np.ix_(index, index)
+        n = self._n[block]
+        mean_i = self._sum[block] / n
+        mean_j = mean_i.T
+        cov = self._cross[block] / n - mean_i * mean_j
+        var_i = self._sum_sq[block] / n - mean_i ** 2
+        var_j = var_i.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / np.sqrt(var_i * var_j)
+        return pd.DataFrame(np.clip(corr, -1, 1), index=columns, columns=columns)
+
+    def _add_correlation_columns(self, new):
+        old = list(self.corr_columns)
+        every = old + new
+        k_old, k = len(old), len(every)
+        # Shift by the column means for numerical stability of the raw cross products
+        shift = np.concatenate([self._shift, [self.stats[column].mean for column in new]])
+
+        n = np.zeros((k, k))
+        sums = np.zeros((k, k))
+        sums_sq = np.zeros((k, k))
+        cross = np.zeros((k, k))
+        n[:k_old, :k_old] = self._n
+        sums[:k_old, :k_old] = self._sum
+        sums_sq[:k_old, :k_old] = self._sum_sq
+        cross[:k_old, :k_old] = self._cross
+
+        rows = slice(0, k)
+        cols = slice(k_old, k)
+        for chunk in self._chunks(every):
+            values = chunk.to_numpy(dtype=float) - shift
+            present = ~np.isnan(values)
+            values = np.where(present, values, 0.0)
+            mask = present.astype(float)
+            # Only the new columns' row/column blocks are computed
+            n[rows, cols] += mask.T @ mask[:, cols]
+            sums[rows, cols] += values.T @ mask[:, cols]
+            sums[cols, :k_old] += values[:, cols].T @ mask[:, :k_old]
+            sums_sq[rows, cols] += (values ** 2).T @ mask[:, cols]
+            sums_sq[cols, :k_old] += (values[:, cols] ** 2).T @ mask[:, :k_old]
+            cross[rows, cols] += values.T @ values[:, cols]
+        n[cols, :k_old] = n[:k_old, cols].T
+        cross[cols, :k_old] = cross[:k_old, cols].T
+
+        self.corr_columns = every
+        self._shift = shift
+        self._n, self._sum, self._sum_sq, self._cross = n, sums, sums_sq, cross
+
+    def value_counts(self, column):
+        self.profile([column])
+        return self.stats[column].value_counts
+
+    def box_stats(self, columns):
+        self.profile(columns)
+        stats = []
+        for column in columns:
+            low, q1, median, q3, high = self.stats[column].quantiles([0.0, 0.25, 0.5, 0.75, 1.0])
+            iqr = q3 - q1
+            stats.append({'label': column, 'med': median, 'q1': q1, 'q3': q3,
+                          'whislo': max(low, q1 - 1.5 * iqr), 'whishi': min(high, q3 + 1.5 * iqr), 'fliers': []})
+        return stats
+
+
+def get_profiler(data_key, source):
+    profiler = _profilers.get(data_key)
+    if profiler is None:
+        profiler = Profiler(source)
+        _profilers.put(data_key, profiler)
+    return profiler
@@ -0,0 +1,254 @@
+"""Exported models and a local HTTP scoring service.
+
+A ``ScoringModel`` bundles a fitted estimator with the preprocessing it was
+trained behind (the fitted ``Preprocessor``: back-fill plus the encoded column
+schema), so new raw rows can be scored without the original upload.
+
+The service batches concurrent requests together: each ``POST /predict``
+joins a queue, and a single worker thread takes up to ``max_batch_rows``
+rows (waiting at most ``max_wait_ms`` for more to arrive) and scores them
+with one vectorised ``predict`` call.
+"""
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from preprocessing import feature_matrix
+
+
+MAX_BATCH_ROWS = 4096
+MAX_WAIT_MS = 5
+LATENCY_WINDOW = 10000
+
+
+class ScoringModel:
+    """A fitted estimator plus everything needed to turn raw rows into its input."""
+
+    def __init__(self, model_name, estimator, features, target, preprocessor=None, use_sparse=True):
+        self.model_name = model_name
+        self.estimator = estimator
+        self.features = list(features)
+        self.target = target
+        self.preprocessor = preprocessor
+        self.use_sparse = use_sparse
+
+    def prepare(self, df, groups=None):
+        if self.preprocessor is not None:
+            df = self.preprocessor.transform(df, groups=groups)
+        missing = [column for column in self.features if column not in df.columns]
+        if missing:
+            raise ValueError(f"missing feature columns: {', '.join(missing)}")
+        X, _ = feature_matrix(df, self.features, use_sparse=self.use_sparse)
+        return X
+
+    def predict(self, df, groups=None):
+        return self.estimator.predict(self.prepare(df, groups=groups))
+
+    def save(self, path):
+        joblib.dump(self, path)
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        joblib.dump(self, buffer)
+        return buffer.getvalue()
+
+
+def load_model(path):
+    model = joblib.load(path)
+    if not isinstance(model, ScoringModel):
+        raise ValueError(f'{path} is not an exported model')
+    return model
+
+
+class ScoringStats:
+    """Request counts, batch sizes and a sliding window of request latencies."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_batch(self, n_requests, n_rows, latencies, failed=False):
+        with self.lock:
+            self.batches += 1
+            self.requests += n_requests
+            self.rows += n_rows
+            self.errors += n_requests if failed else 0
+            self.latencies.extend(latencies)
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            latencies = np.array(self.latencies) * 1000
+            p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (None, None)
+            return {
+                'requests': self.requests,
+                'rows': self.rows,
+                'batches': self.batches,
+                'errors': self.errors,
+                'rows_per_batch': self.rows / self.batches if self.batches else None,
+                'throughput_rows_per_s': self.rows / elapsed if elapsed else None,
+                'throughput_requests_per_s': self.requests / elapsed if elapsed else None,
+                'latency_ms': {'p50': p50, 'p99': p99, 'window': len(latencies)},
+            }
+
+
+class MicroBatcher:
+    """Scores queued requests in batches on a single background thread."""
+
+    def __init__(self, model, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.stats = ScoringStats()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='scoring', daemon=True)
+        self._thread.start()
+
+    def submit(self, df):
+        """Queue a frame of raw rows; returns a future of its predictions."""
+        future = Future()
+        self._queue.put((df, future, time.perf_counter()))
+        return future
+
+    def predict(self, df):
+        return self.submit(df).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_rows:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            frames = [df for df, _, _ in batch]
+            sizes = [len(df) for df in frames]
+            try:
+                # Every request is its own group, so back-filling never crosses requests
+                combined = pd.concat(frames, ignore_index=True)
+                groups = np.repeat(np.arange(len(frames)), sizes)
+                predictions = self.model.predict(combined, groups=groups)
+            except Exception:
+                # One bad request (unknown columns, nulls left after back-filling, ...)
+                # shouldn't fail the others it was batched with
+                self._score_separately(batch)
+                continue
+            offsets = np.cumsum([0] + sizes)
+            now = time.perf_counter()
+            for (_, future, _), start, stop in zip(batch, offsets[:-1], offsets[1:]):
+                future.set_result(predictions[start:stop])
+            self.stats.record_batch(len(batch), sum(sizes), [now - t for _, _, t in batch])
+
+    def _score_separately(self, batch):
+        for df, future, submitted in batch:
+            try:
+                future.set_result(self.model.predict(df))
+                failed = False
+            except Exception as e:
+                future.set_exception(e)
+                failed = True
+            self.stats.record_batch(1, len(df), [time.perf_counter() - submitted], failed=failed)
+
+
+def _rows_frame(payload):
+    # Accepts {"rows": [{...}, ...]}, a bare list of records, or {"columns": {...}} column arrays
+    if isinstance(payload, dict) and 'columns' in payload:
+        return pd.DataFrame(payload['columns'])
+    rows = payload.get('rows') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list):
+        raise ValueError('expected {"rows": [...]} or a list of records')
+    return pd.DataFrame.from_records(rows)
+
+
+def _plain(values):
+    return np.asarray(values).tolist()
+
+
+def make_handler(batcher):
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send(200, batcher.stats.summary())
+            elif self.path == '/health':
+                model = batcher.model
+                self._send(200, {'status': 'ok', 'model': model.model_name, 'features': model.features,
+                                 'target': model.target})
+            else:
+                self._send(404, {'error': f'no route {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send(404, {'error': f'no route {self.path}'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                df = _rows_frame(json.loads(self.rfile.read(length) or b'null'))
+            except (ValueError, AttributeError) as e:
+                self._send(400, {'error': str(e)})
+                return
+            try:
+                predictions = batcher.predict(df)
+            except Exception as e:
+                self._send(422, {'error': str(e)})
+                return
+            self._send(200, {'predictions': _plain(predictions)})
+
+        def log_message(self, format, *args):
+            # Per-request access logs would dominate the cost of small requests
+            pass
+
+    return ScoringHandler
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Bursts of concurrent clients are the point; the default backlog of 5 resets them
+    request_queue_size = 1024
+
+
+def serve(model, host='127.0.0.1', port=8000, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+    """Run the scoring service until interrupted. Returns the server's final metrics."""
+    batcher = MicroBatcher(model, max_batch_rows=max_batch_rows, max_wait_ms=max_wait_ms)
+    server = ScoringServer((host, port), make_handler(batcher))
+    print(f'Serving {model.model_name} on http://{host}:{server.server_address[1]} '
+          f'(POST /predict, GET /metrics, GET /health)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return batcher.stats.summary()
@@ -0,0 +1,113 @@
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import SVC, LinearSVC
+
+
+# Above this many training rows the exact kernel SVM (quadratic to cubic in n) is swapped for a linear solver
+EXACT_MAX_ROWS = 20000
+APPROXIMATION_COMPONENTS = 500
+
+SOLVERS = {
+    'auto': 'Automatic (by training set size)',
+    'exact': 'Exact kernel SVM (libsvm SVC)',
+    'linear': 'Linear SVM (liblinear LinearSVC)',
+    'nystroem': 'Nystroem kernel approximation + LinearSVC',
+    'rff': 'Random Fourier features + LinearSVC',
+}
+
+
+def kernel_solvers(kernel):
+    """The solvers that can fit ``kernel``, in ``SOLVERS`` order."""
+    return [solver for solver in SOLVERS
+            if not (solver == 'linear' and kernel != 'linear') and not (solver == 'rff' and kernel != 'rbf')]
+
+
+def choose_solver(n_rows, kernel, max_exact_rows=EXACT_MAX_ROWS):
+    if n_rows <= max_exact_rows:
+        return 'exact'
+    return 'linear' if kernel == 'linear' else 'nystroem'
+
+
+def scale_gamma(X):
+    # SVC's gamma='scale': 1 / (n_features * X.var()), which the kernel approximations don't accept
+    if sparse.issparse(X):
+        mean = X.mean()
+        variance = X.multiply(X).mean() - mean ** 2
+    else:
+        variance = np.asarray(X, dtype=float).var()
+    return 1.0 / (X.shape[1] * variance) if variance > 0 else 1.0
+
+
+class ScalableSVC(ClassifierMixin, BaseEstimator):
+    """SVM classifier that picks a solver the training set size can afford.
+
+    With ``solver='auto'`` up to ``max_exact_rows`` rows are fitted with the
+    exact ``SVC``. Larger training sets use ``LinearSVC`` for the linear
+    kernel, or a Nystroem approximation of the chosen kernel followed by
+    ``LinearSVC``. ``'rff'`` (random Fourier features) is available for the
+    RBF kernel. ``C`` and ``kernel`` are honoured by every solver; the one used
+    is kept in ``solver_`` and the fit time in ``fit_time_``.
+    """
+
+    def __init__(self, C=1.0, kernel='rbf', gamma='scale', degree=3, coef0=0.0, solver='auto',
+                 max_exact_rows=EXACT_MAX_ROWS, n_components=APPROXIMATION_COMPONENTS, random_state=42):
+        self.C = C
+        self.kernel = kernel
+        self.gamma = gamma
+        self.degree = degree
+        self.coef0 = coef0
+        self.solver = solver
+        self.max_exact_rows = max_exact_rows
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def _build(self, solver, X):
+        if solver == 'exact':
+            return SVC(C=self.C, kernel=self.kernel, gamma=self.gamma, degree=self.degree, coef0=self.coef0,
+                       random_state=self.random_state)
+        # Hinge loss, as in SVC, solved in the dual by coordinate descent (linear in n per pass)
+        linear = LinearSVC(C=self.C, loss='hinge', dual=True, random_state=self.random_state)
+        if solver == 'linear':
+            return linear
+        gamma = scale_gamma(X) if self.gamma == 'scale' else self.gamma
+        n_components = min(self.n_components, X.shape[0])
+        if solver == 'rff':
+            if self.kernel != 'rbf':
+                raise ValueError(f"random Fourier features only approximate the rbf kernel, not {self.kernel!r}")
+            features = RBFSampler(gamma=gamma, n_components=n_components, random_state=self.random_state)
+        else:
+            features = Nystroem(kernel=self.kernel, gamma=gamma, degree=self.degree, coef0=self.coef0,
+                                n_components=n_components, random_state=self.random_state)
+        return make_pipeline(features, linear)
+
+    def fit(self, X, y):
+        if self.solver not in SOLVERS:
+            raise ValueError(f'Unknown SVM solver: {self.solver}')
+        solver = choose_solver(X.shape[0], self.kernel, self.max_exact_rows) if self.solver == 'auto' else self.solver
+        if solver == 'linear' and self.kernel != 'linear':
+            raise ValueError(f'The linear solver only fits the linear kernel, not {self.kernel!r}')
+        start = time.perf_counter()
+        self.estimator_ = self._build(solver, X).fit(X, y)
+        self.fit_time_ = time.perf_counter() - start
+        self.solver_ = solver
+        self.classes_ = self.estimator_.classes_
+        self.n_features_in_ = X.shape[1]
+        return self
+
+    def predict(self, X):
+        return self.estimator_.predict(X)
+
+    def decision_function(self, X):
+        return self.estimator_.decision_function(X)
+
+    @property
+    def coef_(self):
+        # Only a linear model over the original features has per-feature coefficients
+        if self.kernel != 'linear' or self.solver_ not in ('exact', 'linear'):
+            raise AttributeError('coef_ is only available for the linear kernel')
+        return self.estimator_.coef_
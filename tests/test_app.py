@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from app import evaluate_dataset, output_names
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'CACHE_DIR', str(tmp_path / 'cache'))
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame({'a': rng.normal(size=n), 'c': rng.choice(list('pqr'), n),
+                       'species': rng.choice(['setosa', 'virginica'], n)})
+    path = tmp_path / 'iris.csv'
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def test_text_target_is_not_encoded(dataset, tmp_path):
+    result = evaluate_dataset(dataset, 'Logistic Regression', 'species', output=str(tmp_path / 'out'))
+    assert result['features'] == ['a', 'c_p', 'c_q', 'c_r']
+    with open(f"{result['output']}/metrics.json") as f:
+        assert json.load(f)['target'] == 'species'
+
+
+def test_raw_feature_names_are_expanded(dataset, tmp_path):
+    result = evaluate_dataset(dataset, 'Decision Tree', 'species', features=['c'], output=str(tmp_path / 'out'))
+    assert result['features'] == ['c_p', 'c_q', 'c_r']
+
+
+def test_unknown_feature_names_are_rejected(dataset, tmp_path):
+    with pytest.raises(ValueError, match="no feature column.*'zz'"):
+        evaluate_dataset(dataset, 'Decision Tree', 'species', features=['zz'], output=str(tmp_path / 'out'))
+
+
+def test_output_names_are_unique():
+    assert output_names(['x/d.csv', 'x/d.parquet', 'e.csv']) == {'x/d.csv': 'd-csv', 'x/d.parquet': 'd-parquet',
+                                                                 'e.csv': 'e'}
+    with pytest.raises(ValueError, match='same output directory'):
+        output_names(['a_b.csv', 'a-b.csv'])
+
+
+def test_params_override_defaults(dataset, tmp_path):
+    result = evaluate_dataset(dataset, 'Random Forest', 'species', params={'n_estimators': 5}, output=str(tmp_path / 'out'))
+    assert result['params'] == {'n_estimators': 5, 'max_depth': 10}
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from sklearn.calibration import calibration_curve
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import average_precision_score, precision_recall_curve, roc_auc_score, roc_curve
+from sklearn.svm import LinearSVC
+
+from curves import ScoreCurves, binary_curve, calibration
+
+
+@pytest.fixture
+def scored():
+    rng = np.random.default_rng(0)
+    positive = rng.random(2000) < 0.3
+    # Rounded so that many rows share a score, as with tree probabilities
+    score = np.round(positive * 0.8 + rng.normal(size=2000), 1)
+    return positive, score
+
+
+def test_binary_curve_matches_sklearn(scored):
+    positive, score = scored
+    curve = binary_curve(positive, score)
+    assert curve['roc_auc'] == pytest.approx(roc_auc_score(positive, score), rel=1e-12)
+    assert curve['average_precision'] == pytest.approx(average_precision_score(positive, score), rel=1e-12)
+    fpr, tpr, thresholds = roc_curve(positive, score, drop_intermediate=False)
+    np.testing.assert_allclose(curve['fpr'], fpr)
+    np.testing.assert_allclose(curve['tpr'], tpr)
+    np.testing.assert_array_equal(curve['thresholds'], thresholds[1:])
+    precision, recall, _ = precision_recall_curve(positive, score)
+    # sklearn lists the points from the lowest threshold up and ends on (recall 0, precision 1)
+    np.testing.assert_allclose(curve['precision'][1:], precision[::-1][1:])
+    np.testing.assert_allclose(curve['recall'][1:], recall[::-1][1:])
+
+
+def test_binned_curve_is_close(scored):
+    positive, score = scored
+    score = score + np.random.default_rng(1).normal(scale=1e-3, size=len(score))
+    curve = binary_curve(positive, score, bins=2048)
+    assert curve['roc_auc'] == pytest.approx(roc_auc_score(positive, score), abs=1e-3)
+    assert curve['average_precision'] == pytest.approx(average_precision_score(positive, score), abs=1e-2)
+
+
+def test_single_class_has_no_auc():
+    curve = binary_curve(np.ones(10, dtype=bool), np.arange(10.0))
+    assert np.isnan(curve['roc_auc'])
+
+
+def test_calibration_matches_sklearn():
+    rng = np.random.default_rng(0)
+    probability = rng.random(5000)
+    positive = rng.random(5000) < probability
+    predicted, observed, _ = calibration(positive, probability, bins=10)
+    expected_observed, expected_predicted = calibration_curve(positive, probability, n_bins=10)
+    np.testing.assert_allclose(predicted, expected_predicted)
+    np.testing.assert_allclose(observed, expected_observed)
+
+
+@pytest.mark.parametrize('estimator', [LogisticRegression(), LinearSVC()])
+def test_score_curves_one_vs_rest(estimator):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(1500, 4))
+    y = np.digitize(X[:, 0] + 0.5 * rng.normal(size=1500), [-0.5, 0.5])
+    estimator.fit(X[:1000], y[:1000])
+    curves = ScoreCurves(estimator, X[1000:], y[1000:])
+    assert curves.is_probability == hasattr(estimator, 'predict_proba')
+    for column, label in enumerate(estimator.classes_):
+        expected = roc_auc_score(y[1000:] == label, curves.scores[:, column])
+        assert curves.curves[label]['roc_auc'] == pytest.approx(expected, rel=1e-12)
+
+
+def test_score_curves_binary_uses_positive_class():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(500, 3))
+    y = np.where(X[:, 0] > 0, 'yes', 'no')
+    estimator = LinearSVC().fit(X, y)
+    curves = ScoreCurves(estimator, X, y)
+    assert list(curves.curves) == ['yes']
+    expected = roc_auc_score(y == 'yes', estimator.decision_function(X))
+    assert curves.curves['yes']['roc_auc'] == pytest.approx(expected, rel=1e-12)
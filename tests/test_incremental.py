@@ -0,0 +1,103 @@
+import joblib
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LinearRegression
+
+import incremental
+from incremental import (IncrementalSession, OnlineLinearClassifier, StreamingLinearRegression, get_session,
+                         grow_forest)
+
+
+@pytest.fixture
+def regression():
+    rng = np.random.default_rng(0)
+    X = rng.normal(5.0, 2.0, size=(1200, 6))
+    y = X @ rng.normal(size=6) + 3.0 + rng.normal(scale=0.1, size=1200)
+    return X, y
+
+
+@pytest.mark.parametrize('to_input', [np.asarray, sparse.csr_matrix])
+def test_streaming_linear_regression_matches_batch(regression, to_input):
+    X, y = regression
+    model = StreamingLinearRegression()
+    for start in range(0, len(X), 250):
+        model.partial_fit(to_input(X[start:start + 250]), y[start:start + 250])
+    expected = LinearRegression().fit(X, y)
+    np.testing.assert_allclose(model.coef_, expected.coef_, rtol=1e-8)
+    assert model.intercept_ == pytest.approx(expected.intercept_, rel=1e-8)
+    np.testing.assert_allclose(model.predict(to_input(X[:10])), expected.predict(X[:10]), rtol=1e-8)
+
+
+def test_streaming_linear_regression_fit_resets(regression):
+    X, y = regression
+    model = StreamingLinearRegression().partial_fit(X[:100], y[:100]).fit(X[100:], y[100:])
+    assert model.n_seen_ == len(X) - 100
+    np.testing.assert_allclose(model.coef_, LinearRegression().fit(X[100:], y[100:]).coef_, rtol=1e-8)
+
+
+def test_online_classifier_rejects_new_classes():
+    X = np.random.default_rng(0).normal(size=(100, 3))
+    model = OnlineLinearClassifier().fit(X, np.arange(100) % 2)
+    with pytest.raises(ValueError, match='classes'):
+        model.partial_fit(X[:10], np.full(10, 2))
+
+
+def test_session_applies_each_chunk_once(regression):
+    X, y = regression
+    session = IncrementalSession('Linear Regression', {})
+    session.fit(X[:800], y[:800])
+    assert session.update('a', X[800:1000], y[800:1000])['Total Rows'] == 1000
+    assert session.update('a', X[800:1000], y[800:1000]) is None
+    session.update('b', X[1000:], y[1000:])
+    np.testing.assert_allclose(session.estimator.coef_, LinearRegression().fit(X, y).coef_, rtol=1e-8)
+    assert list(session.history().index) == [0, 1, 2]
+
+
+def test_session_survives_reload(regression, tmp_path):
+    X, y = regression
+    session = get_session('key', 'Linear Regression', {}, persist=True, session_dir=tmp_path)
+    session.fit(X[:800], y[:800])
+    session.update('a', X[800:], y[800:])
+    incremental._sessions.clear()
+    reloaded = get_session('key', 'Linear Regression', {}, persist=True, session_dir=tmp_path)
+    assert reloaded is not session
+    assert reloaded.fitted and reloaded.chunk_keys == ['a'] and reloaded.rows == len(X)
+    assert reloaded.update('a', X[800:], y[800:]) is None
+    np.testing.assert_allclose(reloaded.estimator.coef_, session.estimator.coef_)
+
+
+def test_forest_session_saves_only_new_trees(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 4))
+    y = (X[:, 0] > 0).astype(int)
+    session = get_session('forest', 'Random Forest', {'n_estimators': 10, 'max_depth': 4}, persist=True,
+                          session_dir=tmp_path)
+    session.fit(X[:200], y[:200])
+    for i, start in enumerate(range(200, 400, 50)):
+        session.update(f'chunk{i}', X[start:start + 50], y[start:start + 50])
+    # Each chunk file holds that chunk's trees only
+    _, _, trees = joblib.load(tmp_path / 'forest' / 'chunk-000004.joblib')
+    assert len(trees) == 2 and len(session.estimator.estimators_) == 18
+
+    incremental._sessions.clear()
+    reloaded = get_session('forest', 'Random Forest', {'n_estimators': 10, 'max_depth': 4}, persist=True,
+                           session_dir=tmp_path)
+    assert reloaded.chunk_keys == session.chunk_keys and reloaded.rows == 400
+    np.testing.assert_array_equal(reloaded.estimator.predict_proba(X), session.estimator.predict_proba(X))
+
+
+def test_sessions_are_not_persisted_by_default():
+    assert get_session('memory-only', 'Linear Regression', {}).directory is None
+
+
+def test_grown_forest_keeps_class_columns():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 4))
+    y = np.arange(300) % 3
+    forest = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+    # The chunk lacks class 2, but the new trees must still vote over all three classes
+    grow_forest(forest, X[:30], y[:30] % 2, n_new=3)
+    assert len(forest.estimators_) == 8
+    assert forest.predict_proba(X).shape == (300, 3)
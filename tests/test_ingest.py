@@ -0,0 +1,88 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from ingest import parse_csv, parse_csv_chunked
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'CACHE_DIR', str(tmp_path))
+    ingest._stores.clear()
+    return tmp_path
+
+
+@pytest.fixture
+def late_text_csv():
+    # Numeric for well beyond the dtype sample, then one text value
+    n = 30000
+    a = pd.Series(np.arange(n) * 0.5, dtype=object)
+    a[25000] = 'n/a-text'
+    df = pd.DataFrame({'a': a, 'b': np.where(np.arange(n) % 3, 'x', 'y'), 'y': np.arange(n) % 2})
+    return df.to_csv(index=False).encode()
+
+
+@pytest.mark.parametrize('max_rows', [None, 1000])
+def test_chunked_parse_falls_back_on_late_text(late_text_csv, max_rows):
+    df, stats = parse_csv_chunked(late_text_csv, chunksize=10000, max_rows=max_rows)
+    assert stats['rows_read'] == 30000
+    assert len(df) == (max_rows or 30000)
+    # Text throughout, as in the non-streaming parse
+    assert df['a'].dropna().map(type).eq(str).all()
+    assert pd.api.types.is_numeric_dtype(df['y'])
+    if max_rows is None:
+        assert df['a'][[1, 24999, 25000, 25001]].tolist() == ['0.5', '12499.5', 'n/a-text', '12500.5']
+        assert df['a'][25000] == parse_csv(late_text_csv)['a'][25000]
+
+
+def test_streaming_upload_with_late_text(late_text_csv):
+    key, store, stats = ingest.load_store(io.BytesIO(late_text_csv), streaming=True, chunksize=10000)
+    assert len(store) == 30000
+    assert store.read(['a'])['a'][25000] == 'n/a-text'
+
+
+def test_disk_cache_keeps_sample_stats():
+    data = pd.DataFrame({'a': np.arange(5000), 'b': np.arange(5000) % 7}).to_csv(index=False).encode()
+    _, _, stats = ingest.load_store(io.BytesIO(data), streaming=True, chunksize=1000, max_rows=100)
+    # As after a restart: only the Parquet cache is left
+    ingest._stores.clear()
+    _, store, cached = ingest.load_store(io.BytesIO(data), streaming=True, chunksize=1000, max_rows=100)
+    assert not store.loaded_columns
+    assert cached['sampled'] is True
+    assert (cached['rows_read'], cached['rows_kept']) == (stats['rows_read'], stats['rows_kept']) == (5000, 100)
+
+
+def test_disk_cache_reports_file_size(cache_dir):
+    data = pd.DataFrame({'a': np.arange(5000) * 0.5, 'b': np.arange(5000) % 7}).to_csv(index=False).encode()
+    key, _, _ = ingest.load_store(io.BytesIO(data))
+    ingest._stores.clear()
+    _, _, stats = ingest.load_store(io.BytesIO(data))
+    size = (cache_dir / f'{key}.parquet').stat().st_size
+    assert stats['memory_bytes'] == stats['peak_bytes'] == size > 0
+
+
+def test_prune_disk_cache_evicts_least_recently_used(cache_dir):
+    for i, name in enumerate(['a.parquet', 'b.parquet', 'c.parquet']):
+        path = cache_dir / name
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (i, i))
+    session = cache_dir / 'd.parquet'
+    session.mkdir()
+    (session / 'base.joblib').write_bytes(b'x' * 100)
+    os.utime(session, (3, 3))
+    (cache_dir / 'other.txt').write_bytes(b'x' * 1000)
+
+    ingest.touch(cache_dir / 'a.parquet')
+    ingest.prune_disk_cache(cache_dir, 250, suffix='.parquet', keep=[cache_dir / 'b.parquet'])
+
+    assert sorted(p.name for p in cache_dir.iterdir()) == ['a.parquet', 'b.parquet', 'other.txt']
+
+
+def test_prune_disk_cache_keeps_newest_entry(cache_dir):
+    (cache_dir / 'a.parquet').write_bytes(b'x' * 100)
+    ingest.prune_disk_cache(cache_dir, 10, suffix='.parquet')
+    assert (cache_dir / 'a.parquet').exists()
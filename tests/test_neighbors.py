@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.neighbors import KNeighborsClassifier, NearestNeighbors
+
+from neighbors import IVFIndex, IVFKNeighborsClassifier, compare_to_exact
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 8)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] > 0).astype(int) + (X[:, 2] > 1)
+    Q = rng.normal(size=(300, 8)).astype(np.float32)
+    return X, y, Q
+
+
+def test_search_probing_every_list_is_exact(data):
+    X, _, Q = data
+    index = IVFIndex(X, n_lists=16)
+    distances, indices = index.search(Q, 5, n_probe=16)
+    exact_distances, exact_indices = NearestNeighbors(n_neighbors=5).fit(X).kneighbors(Q)
+    np.testing.assert_array_equal(indices, exact_indices)
+    np.testing.assert_allclose(distances, exact_distances, rtol=1e-4, atol=1e-4)
+
+
+def test_search_with_fewer_probes_returns_valid_neighbours(data):
+    X, _, Q = data
+    index = IVFIndex(X, n_lists=16)
+    distances, indices = index.search(Q, 5, n_probe=2)
+    assert (indices >= 0).all()
+    np.testing.assert_allclose(distances, np.linalg.norm(Q[:, None] - X[indices], axis=2), rtol=1e-4, atol=1e-4)
+    # Nearest first
+    assert (np.diff(distances, axis=1) >= 0).all()
+
+
+def test_missing_neighbours_are_marked(data):
+    X, _, Q = data
+    distances, indices = IVFIndex(X[:3], n_lists=1).search(Q[:4], 5)
+    assert (indices[:, 3:] == -1).all()
+    assert np.isinf(distances[:, 3:]).all()
+
+
+def test_classifier_probing_every_list_matches_exact_knn(data):
+    X, y, Q = data
+    approximate = IVFKNeighborsClassifier(n_neighbors=5, n_probe=16, n_lists=16).fit(sparse.csr_matrix(X), y)
+    exact = KNeighborsClassifier(n_neighbors=5).fit(X, y)
+    np.testing.assert_array_equal(approximate.predict(Q), exact.predict(Q))
+    np.testing.assert_allclose(approximate.predict_proba(Q), exact.predict_proba(Q))
+
+
+def test_compare_to_exact(data):
+    X, y, Q = data
+    y_test = (Q[:, 0] + Q[:, 1] > 0).astype(int)
+    approximate = IVFKNeighborsClassifier(n_neighbors=5, n_probe=16, n_lists=16).fit(X, y)
+    report = compare_to_exact(approximate, X, y, Q, y_test, sample=100)
+    assert report['Rows Compared'] == 100
+    assert report['Neighbor Recall@5'] == 1.0
+    assert report['Prediction Agreement'] == 1.0
+    assert report['Accuracy Loss'] == 0.0
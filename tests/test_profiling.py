@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from profiling import Profiler
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    n = 1000
+    a = rng.normal(1e6, 1.0, n)
+    df = pd.DataFrame({'a': a, 'b': 2 * a + rng.normal(size=n), 'c': rng.exponential(size=n),
+                       'd': rng.integers(0, 5, n).astype(float)})
+    # Different null patterns per column, so every pair has its own complete rows
+    for column, fraction in [('a', 0.1), ('c', 0.2), ('d', 0.05)]:
+        df.loc[rng.random(n) < fraction, column] = np.nan
+    return df
+
+
+def test_correlation_matches_pandas(frame):
+    profiler = Profiler(frame, chunk_rows=128)
+    columns = list(frame.columns)
+    np.testing.assert_allclose(profiler.correlation(columns), frame.corr(), atol=1e-9)
+
+
+def test_correlation_added_columns_match_pandas(frame):
+    # Columns added later only fill in their row and column of the running sums
+    profiler = Profiler(frame, chunk_rows=128)
+    profiler.correlation(['a', 'c'])
+    profiler.correlation(['d'])
+    columns = ['d', 'b', 'a', 'c']
+    np.testing.assert_allclose(profiler.correlation(columns), frame[columns].corr(), atol=1e-9)
+
+
+def test_profile_moments_match_pandas(frame):
+    profile = Profiler(frame, chunk_rows=128).profile(frame.columns)
+    described = frame.describe().T
+    np.testing.assert_array_equal(profile['count'], described['count'])
+    np.testing.assert_allclose(profile['mean'], described['mean'], rtol=1e-12)
+    np.testing.assert_allclose(profile['std'], described['std'], rtol=1e-9)
+    np.testing.assert_array_equal(profile['min'], described['min'])
+    np.testing.assert_array_equal(profile['max'], described['max'])
+    np.testing.assert_array_equal(profile['nulls'], frame.isna().sum())
+    np.testing.assert_array_equal(profile['cardinality'], frame.nunique())
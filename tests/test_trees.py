@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.tree import DecisionTreeClassifier
+
+from trees import FeatureBinner, HistogramForestClassifier, HistogramTreeClassifier
+
+
+@pytest.fixture
+def coarse():
+    # Few distinct values per feature, so binning is lossless
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 40, size=(2000, 4)) / 4.0
+    y = ((X[:, 0] > 5) ^ (X[:, 1] < 3)).astype(int) + (X[:, 2] > 8)
+    return X, y
+
+
+def test_bins_follow_edges():
+    X = np.array([[0.0], [1.0], [1.0], [2.0], [np.nan], [3.0]])
+    binner = FeatureBinner(max_bins=4).fit(X)
+    np.testing.assert_allclose(binner.edges_[0], [0.5, 1.5, 2.5])
+    np.testing.assert_array_equal(binner.transform(X).ravel(), [0, 1, 1, 2, 4, 3])
+    # Unseen values land in the bin whose edges enclose them
+    np.testing.assert_array_equal(binner.transform(np.array([[-5.0], [1.5], [9.0]])).ravel(), [0, 1, 3])
+
+
+def test_quantile_bins_on_many_values():
+    X = np.random.default_rng(0).normal(size=(5000, 1))
+    binned = FeatureBinner(max_bins=16).fit_transform(X).ravel()
+    assert binned.dtype == np.uint8
+    assert binned.max() == 15
+    # Binning is monotone: a larger value never gets a smaller bin
+    order = np.argsort(X.ravel())
+    assert (np.diff(binned[order].astype(int)) >= 0).all()
+
+
+def test_display_tree_matches_tree_on_raw_values(coarse):
+    X, y = coarse
+    model = HistogramTreeClassifier(max_depth=6).fit(X, y)
+    raw = DecisionTreeClassifier(max_depth=6, random_state=42).fit(X, y)
+    display = model.display_tree()
+    # Same splits as the raw tree, with thresholds back in feature units
+    np.testing.assert_array_equal(display.tree_.feature, raw.tree_.feature)
+    np.testing.assert_allclose(display.tree_.threshold, raw.tree_.threshold)
+    np.testing.assert_array_equal(display.predict(X), model.predict(X))
+    np.testing.assert_array_equal(model.predict(X), raw.predict(X))
+
+
+def test_sparse_columns_pass_through():
+    rng = np.random.default_rng(0)
+    numeric = rng.normal(size=(3000, 2))
+    onehot = sparse.random(3000, 300, density=0.01, format='csr', random_state=0)
+    onehot.data[:] = 1
+    X = sparse.hstack([sparse.csr_matrix(numeric), onehot], format='csr')
+    y = (numeric[:, 0] + onehot[:, :20].sum(axis=1).A1 > 0.5).astype(int)
+
+    binner = FeatureBinner().fit(X)
+    binned = binner.transform(X)
+    assert sparse.issparse(binned)
+    assert [edges is None for edges in binner.edges_] == [False, False] + [True] * 300
+    # One-hot columns unchanged and still sparse, numeric columns binned in place
+    assert (binned[:, 2:] != onehot).nnz == 0
+    np.testing.assert_array_equal(binned[:, :2].toarray(), FeatureBinner().fit_transform(numeric))
+
+    sparse_model = HistogramTreeClassifier(max_depth=6).fit(X, y)
+    dense_model = HistogramTreeClassifier(max_depth=6).fit(X.toarray(), y)
+    np.testing.assert_array_equal(sparse_model.predict(X), dense_model.predict(X.toarray()))
+    np.testing.assert_array_equal(sparse_model.display_tree().predict(X), sparse_model.predict(X))
+
+
+def test_forest_display_tree(coarse):
+    X, y = coarse
+    forest = HistogramForestClassifier(n_estimators=4, max_depth=5, n_jobs=1).fit(X, y)
+    assert forest.predict_proba(X).shape == (len(X), 3)
+    assert forest.feature_importances_.shape == (4,)
+    tree = forest.estimator_.estimators_[1]
+    np.testing.assert_array_equal(forest.display_tree(1).predict(X), tree.predict(forest.binner_.transform(X)))
+
+
+def test_max_bins_is_validated():
+    with pytest.raises(ValueError, match='max_bins'):
+        FeatureBinner(max_bins=256).fit(np.zeros((3, 1)))
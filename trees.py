@@ -0,0 +1,172 @@
+import copy
+
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin, TransformerMixin
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+
+# Bins per feature for non-missing values; missing values get their own bin after them
+MAX_BINS = 255
+BIN_SAMPLE = 200000
+BIN_CHUNK_ROWS = 65536
+
+
+def _column(X, j):
+    if sparse.issparse(X):
+        return X[:, j].toarray().ravel().astype(float)
+    return np.asarray(X[:, j], dtype=float)
+
+
+def _has_nan(X, j):
+    # Stored values of column j of a CSC matrix (implicit zeros are never missing)
+    return bool(np.isnan(X.data[X.indptr[j]:X.indptr[j + 1]]).any())
+
+
+class FeatureBinner(TransformerMixin, BaseEstimator):
+    """Quantise every feature into at most ``max_bins`` uint8 bins.
+
+    Bin edges are the midpoints between distinct values when a feature has
+    few enough of them, otherwise quantiles of a row sample. A value lands in
+    the bin counting the edges below it, so ``bin <= b`` exactly when
+    ``value <= edges[b]``. Missing values go to bin ``max_bins``.
+
+    Sparse input stays sparse: columns that already have at most ``max_bins``
+    distinct values and no missing ones (e.g. one-hot and hashed columns) are
+    passed through as they are, with ``None`` edges, since binning them would
+    not remove any split candidates. Only the other columns are densified.
+    """
+
+    def __init__(self, max_bins=MAX_BINS, sample=BIN_SAMPLE, random_state=42):
+        self.max_bins = max_bins
+        self.sample = sample
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        if not 2 <= self.max_bins <= 255:
+            raise ValueError(f'max_bins must be between 2 and 255, not {self.max_bins}')
+        is_sparse = sparse.issparse(X)
+        X = X.tocsc() if is_sparse else np.asarray(X, dtype=float)
+        rows = np.arange(X.shape[0])
+        if X.shape[0] > self.sample:
+            rows = np.sort(np.random.default_rng(self.random_state).choice(X.shape[0], self.sample, replace=False))
+        self.edges_ = []
+        for j in range(X.shape[1]):
+            values = _column(X, j)[rows]
+            values = values[~np.isnan(values)]
+            distinct = np.unique(values)
+            if is_sparse and len(distinct) <= self.max_bins and not _has_nan(X, j):
+                # Passed through raw, and stays sparse
+                self.edges_.append(None)
+                continue
+            if len(distinct) <= self.max_bins:
+                edges = (distinct[:-1] + distinct[1:]) / 2
+            else:
+                edges = np.unique(np.quantile(values, np.linspace(0, 1, self.max_bins + 1)[1:-1]))
+            self.edges_.append(edges)
+        self.n_features_in_ = X.shape[1]
+        return self
+
+    def _bin(self, X, columns):
+        binned = np.empty((X.shape[0], len(columns)), dtype=np.uint8)
+        for i, j in enumerate(columns):
+            column, edges = _column(X, j), self.edges_[j]
+            for start in range(0, len(column), BIN_CHUNK_ROWS):
+                chunk = column[start:start + BIN_CHUNK_ROWS]
+                binned[start:start + BIN_CHUNK_ROWS, i] = np.where(np.isnan(chunk), self.max_bins,
+                                                                   np.searchsorted(edges, chunk, side='left'))
+        return binned
+
+    def transform(self, X):
+        raw = [j for j, edges in enumerate(self.edges_) if edges is None]
+        if not raw and not sparse.issparse(X):
+            X = np.asarray(X, dtype=float)
+            return self._bin(X, range(X.shape[1]))
+        # Binned columns are stored sparse (bin 0 as an implicit zero) next to the raw ones, in the original order
+        X = sparse.csc_matrix(X)
+        binned = [j for j, edges in enumerate(self.edges_) if edges is not None]
+        blocks = [sparse.csc_matrix(self._bin(X, binned))] if binned else []
+        if raw:
+            blocks.append(X[:, raw])
+        order = np.argsort(binned + raw)
+        return sparse.hstack(blocks, format='csc')[:, order].tocsr()
+
+
+def unbinned_tree(tree, edges):
+    """A copy of a tree fitted on binned features, with thresholds back in feature units.
+
+    A split ``bin <= b + 0.5`` becomes ``value <= edges[b]``; a split that
+    only separates the missing bin keeps every value on the left. Columns
+    passed through unbinned (``None`` edges) keep their thresholds.
+    """
+    display = copy.deepcopy(tree)
+    state = display.tree_.__getstate__()
+    nodes = state['nodes'].copy()
+    for node in np.flatnonzero(nodes['left_child'] != -1):
+        feature_edges = edges[nodes['feature'][node]]
+        if feature_edges is None:
+            continue
+        b = int(nodes['threshold'][node])
+        nodes['threshold'][node] = feature_edges[b] if b < len(feature_edges) else np.inf
+    state['nodes'] = nodes
+    display.tree_.__setstate__(state)
+    return display
+
+
+class _BinnedTrees(ClassifierMixin, BaseEstimator):
+    # Fits ``_build()`` on the uint8-binned features and bins again at prediction time
+
+    def fit(self, X, y):
+        self.binner_ = FeatureBinner(max_bins=self.max_bins, random_state=self.random_state).fit(X)
+        self.estimator_ = self._build().fit(self.binner_.transform(X), y)
+        self.classes_ = self.estimator_.classes_
+        self.n_features_in_ = self.binner_.n_features_in_
+        return self
+
+    def predict(self, X):
+        return self.estimator_.predict(self.binner_.transform(X))
+
+    def predict_proba(self, X):
+        return self.estimator_.predict_proba(self.binner_.transform(X))
+
+    @property
+    def feature_importances_(self):
+        return self.estimator_.feature_importances_
+
+
+class HistogramTreeClassifier(_BinnedTrees):
+    """Decision tree on uint8-binned features: at most ``max_bins`` candidate splits per feature."""
+
+    def __init__(self, max_depth=None, max_bins=MAX_BINS, random_state=42):
+        self.max_depth = max_depth
+        self.max_bins = max_bins
+        self.random_state = random_state
+
+    def _build(self):
+        return DecisionTreeClassifier(max_depth=self.max_depth, random_state=self.random_state)
+
+    def display_tree(self):
+        return unbinned_tree(self.estimator_, self.binner_.edges_)
+
+
+class HistogramForestClassifier(_BinnedTrees):
+    """Random forest on uint8-binned features, with the trees fitted on ``n_jobs`` cores.
+
+    With at most ``max_bins`` distinct values per feature, every split search
+    sorts and scans far fewer candidate thresholds than on the raw floats.
+    """
+
+    def __init__(self, n_estimators=100, max_depth=None, max_bins=MAX_BINS, n_jobs=-1, random_state=42):
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.max_bins = max_bins
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def _build(self):
+        return RandomForestClassifier(n_estimators=self.n_estimators, max_depth=self.max_depth, n_jobs=self.n_jobs,
+                                      random_state=self.random_state)
+
+    def display_tree(self, index=0):
+        return unbinned_tree(self.estimator_.estimators_[index], self.binner_.edges_)
@@ -0,0 +1,66 @@
+import pandas as pd
+from scipy.stats import loguniform, randint
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingRandomSearchCV
+
+from models import REGRESSION_MODELS, build_estimator
+
+
+# Same ranges as the sidebar sliders
+SEARCH_SPACES = {
+    'Random Forest': {'n_estimators': randint(1, 101), 'max_depth': randint(1, 21)},
+    'Logistic Regression': {'C': loguniform(0.01, 10.0)},
+    'SVM': {'C': loguniform(0.01, 10.0), 'kernel': ['linear', 'poly', 'rbf', 'sigmoid']},
+    'K-Nearest Neighbors': {'n_neighbors': randint(1, 21)},
+    'Decision Tree': {'max_depth': randint(1, 21)},
+    'Gradient Boosting': {'max_iter': randint(1, 101), 'learning_rate': loguniform(0.01, 1.0)},
+}
+# Held fixed while tuning and reported with the best params, so they key the same as a manual run
+FIXED_PARAMS = {
+    'SVM': {'solver': 'auto'},
+}
+
+
+def _plain(value):
+    # numpy scalars -> python scalars so tuned params give the same model keys as slider values
+    return value.item() if hasattr(value, 'item') else value
+
+
+def tune(model_name, X, y, n_candidates=32, factor=3, cv=3, n_jobs=-1, random_state=42):
+    """Successive-halving random search over the sidebar ranges for ``model_name``.
+
+    Every round fits the surviving candidates on ``factor`` times more rows and
+    keeps the best ``1 / factor`` of them, so poor settings are dropped after
+    being tried on a small subsample. Candidates within a round run in
+    parallel across ``n_jobs`` workers. Returns a dict with the best params,
+    their cross-validated score, the refitted best estimator and a per-round
+    results table.
+    """
+    if model_name not in SEARCH_SPACES:
+        raise ValueError(f'{model_name} has no hyperparameters to tune')
+    fixed = FIXED_PARAMS.get(model_name, {})
+    search = HalvingRandomSearchCV(
+        build_estimator(model_name, fixed),
+        SEARCH_SPACES[model_name],
+        n_candidates=n_candidates,
+        factor=factor,
+        resource='n_samples',
+        min_resources='exhaust',
+        cv=cv,
+        scoring='r2' if model_name in REGRESSION_MODELS else 'accuracy',
+        n_jobs=n_jobs,
+        random_state=random_state,
+        refit=True,
+    )
+    search.fit(X, y)
+
+    results = pd.DataFrame(search.cv_results_)
+    results = results[['iter', 'n_resources', 'params', 'mean_test_score', 'std_test_score']]
+    results = results.sort_values(['iter', 'mean_test_score'], ascending=[True, False]).reset_index(drop=True)
+    return {
+        'best_params': {**fixed, **{name: _plain(value) for name, value in search.best_params_.items()}},
+        'best_score': search.best_score_,
+        'best_estimator': search.best_estimator_,
+        'results': results,
+        'n_rounds': search.n_iterations_,
+    }
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
+from scipy.stats import t
+from sklearn.model_selection import KFold, StratifiedKFold
+
+from models import REGRESSION_MODELS, build_estimator, evaluation_metrics
+
+
+# Arrays above this size are handed to the workers as read-only memory maps
+# instead of being pickled into every process
+MEMMAP_THRESHOLD = '1M'
+
+
+def _fit_fold(model_name, params, X, y, train_index, test_index):
+    # X and y arrive as memory maps; only the fold's rows are copied
+    estimator = build_estimator(model_name, params)
+    estimator.fit(X[train_index], y[train_index])
+    return evaluation_metrics(model_name, y[test_index], estimator.predict(X[test_index]))
+
+
+def _as_array(X):
+    if sparse.issparse(X):
+        return X.tocsr()
+    return X.to_numpy() if isinstance(X, (pd.DataFrame, pd.Series)) else np.asarray(X)
+
+
+def confidence_interval(values, confidence=0.95):
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return np.nan, np.nan
+    half_width = t.ppf((1 + confidence) / 2, len(values) - 1) * values.std(ddof=1) / np.sqrt(len(values))
+    return values.mean() - half_width, values.mean() + half_width
+
+
+def cross_validate(model_name, params, X, y, n_splits=5, stratified=True, n_jobs=-1, random_state=42):
+    """k-fold cross-validation with the folds fitted in parallel worker processes.
+
+    Classifiers use stratified folds unless ``stratified`` is off. Returns
+    ``(per_fold, summary)`` frames; the summary has the mean, standard
+    deviation and 95% confidence interval of every metric.
+    """
+    X = _as_array(X)
+    y = _as_array(y)
+    if stratified and model_name not in REGRESSION_MODELS:
+        splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    else:
+        splitter = KFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+
+    parallel = Parallel(n_jobs=n_jobs, max_nbytes=MEMMAP_THRESHOLD, mmap_mode='r')
+    results = parallel(delayed(_fit_fold)(model_name, params, X, y, train_index, test_index)
+                       for train_index, test_index in splitter.split(X, y))
+
+    per_fold = pd.DataFrame(results)
+    per_fold.index = pd.RangeIndex(1, len(per_fold) + 1, name='Fold')
+    summary = pd.DataFrame({
+        'Mean': per_fold.mean(),
+        'Std': per_fold.std(ddof=1),
+        '95% CI Low': [confidence_interval(per_fold[metric])[0] for metric in per_fold],
+        '95% CI High': [confidence_interval(per_fold[metric])[1] for metric in per_fold],
+    })
+    return per_fold, summary